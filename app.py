@@ -1,34 +1,48 @@
 import os
+import sys
 import pdfplumber
 import logging
 import hashlib
+from array import array
 import json
+import pickle
+import tempfile
 import nltk
 import sqlite3
 from nltk.tokenize import sent_tokenize
+from nltk.stem import PorterStemmer
 from flask import Flask, request, jsonify, render_template, Response, stream_with_context, make_response
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
 from langchain_community.vectorstores import Pinecone as PineconeVectorStore
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
 from langchain_groq import ChatGroq
-from rank_bm25 import BM25Okapi
-from functools import lru_cache
+from functools import lru_cache, cached_property
 import re
-import pandas as pd
+import math
+import numpy as np
+from collections import Counter, OrderedDict
 import warnings
 import google.generativeai as genai
 from docx import Document
 import uuid
 from werkzeug.utils import secure_filename
 from datetime import datetime
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import asyncio
+import threading
 import aiohttp
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+import multiprocessing
+from dataclasses import dataclass
 from asgiref.wsgi import WsgiToAsgi
 import time
 from io import BytesIO
+from pdf_extraction import (
+    markdown_cell_type, render_markdown_table, extract_pdf_chunks, extract_pdf_chunks_timed
+)
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
@@ -52,6 +66,54 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = "hr-knowledge-base"
 POLICIES_FOLDER = "HR_docs/"
+INDEX_CACHE_FOLDER = "index_cache"
+INDEX_MANIFEST_PATH = os.path.join(INDEX_CACHE_FOLDER, "hr_docs_manifest.json")
+INDEX_MANIFEST_VERSION = 5  # Bump when vector IDs or chunk records change shape
+BM25_CACHE_PATH = os.path.join(INDEX_CACHE_FOLDER, "bm25_cache.pkl")
+EMBEDDING_CACHE_PATH = os.path.join(INDEX_CACHE_FOLDER, "embedding_cache.db")
+POLICY_TABLES_DB_PATH = os.path.join(INDEX_CACHE_FOLDER, "policy_tables.db")
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()  # "pinecone" or "local" (in-process, offline)
+LOCAL_VECTOR_FOLDER = os.path.join(INDEX_CACHE_FOLDER, "local_vectors")
+LOCAL_VECTOR_LAYOUT_VERSION = 1  # Bump when the local vector files change shape
+BM25_CACHE_VERSION = 7  # Bump when chunking, enrichment, tokenization or the cached layout changes
+BM25_STEMMING = os.getenv("BM25_STEMMING", "true").lower() == "true"  # Porter-stem BM25 terms
+# Worker processes for PDF extraction during ingestion (1 = extract serially). Workers are
+# spawned and import only pdf_extraction.py, so start the app from run.py/run_production.py
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))  # Chunks embedded per model call during ingestion
+PINECONE_UPSERT_BATCH_SIZE = 100  # Keeps upsert requests under Pinecone's 2 MB limit
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 256))  # Cached /api/ask answers (0 disables)
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))  # Seconds before a cached answer expires
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))  # Cached question embeddings
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 5000))  # Past policy answers reusable for paraphrases (0 disables)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))  # Cosine similarity a past question needs to be reused
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 7 * 24 * 3600))  # Seconds a past answer stays reusable
+SEMANTIC_CACHE_MIN_RATING = int(os.getenv("SEMANTIC_CACHE_MIN_RATING", 3))  # Answers rated below this (1-5) are never reused
+RETRIEVAL_LEG_TIMEOUT = float(os.getenv("RETRIEVAL_LEG_TIMEOUT", 10))  # Seconds each retrieval leg may take before it is dropped
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 8))  # Threads for the vector legs of /api/ask (BM25 runs inline)
+PINECONE_QUERY_TIMEOUT = float(os.getenv("PINECONE_QUERY_TIMEOUT", 8))  # Seconds before a Pinecone query is abandoned client-side
+RRF_K = int(os.getenv("RRF_K", 60))  # Reciprocal rank fusion damping: score = sum(1 / (RRF_K + rank))
+FUSION_TABLE_BOOST = float(os.getenv("FUSION_TABLE_BOOST", 1.2))  # Multiplier on the fused score of table chunks
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", 12))  # Most fused chunks considered for the prompt
+VECTOR_SEARCH_K = int(os.getenv("VECTOR_SEARCH_K", 15))  # Chunks the vector leg returns over the whole corpus
+BM25_SEARCH_K = int(os.getenv("BM25_SEARCH_K", 10))  # Chunks the BM25 leg returns over the whole corpus
+DOCUMENT_ROUTING = os.getenv("DOCUMENT_ROUTING", "true").lower() == "true"  # Narrow retrieval to the policies a question names
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", 1.5))  # idf-weighted title match a policy needs to be routed to
+ROUTER_MAX_SOURCES = int(os.getenv("ROUTER_MAX_SOURCES", 3))  # Questions matching more policies than this search everything
+ROUTED_VECTOR_SEARCH_K = int(os.getenv("ROUTED_VECTOR_SEARCH_K", 8))  # Vector leg k once retrieval is filtered
+ROUTED_BM25_SEARCH_K = int(os.getenv("ROUTED_BM25_SEARCH_K", 6))  # BM25 leg k once retrieval is filtered
+POLICY_TABLE_ANSWERS = os.getenv("POLICY_TABLE_ANSWERS", "true").lower() == "true"  # Answer clear table lookups from the table store, without Gemini
+POLICY_TABLE_MIN_SCORE = float(os.getenv("POLICY_TABLE_MIN_SCORE", 3.0))  # idf-weighted header/title match a table needs to be returned directly
+POLICY_TABLE_MIN_TERMS = int(os.getenv("POLICY_TABLE_MIN_TERMS", 2))  # ...made of at least this many distinct title/column terms
+INTENT_ROUTING = os.getenv("INTENT_ROUTING", "true").lower() == "true"  # Classify questions locally before retrieval/Gemini
+INTENT_MIN_SIMILARITY = float(os.getenv("INTENT_MIN_SIMILARITY", 0.5))  # Cosine to a non-policy intent needed to leave the RAG path
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN", 0.08))  # ...and its lead over the policy intent
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))  # Approximate tokens of retrieved context per prompt
+PACK_DUPLICATE_THRESHOLD = float(os.getenv("PACK_DUPLICATE_THRESHOLD", 0.6))  # Shingle overlap that marks a chunk as a near-duplicate
+PACK_MIN_TAIL_TOKENS = 50  # Do not bother truncating a chunk into less room than this
+CHARS_PER_TOKEN = 4  # Heuristic used to estimate Gemini token counts
+RETRIEVAL_CACHE_MAX_BYTES = int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", 32 * 1024 * 1024))  # Memory cap for cached contexts
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx'}
@@ -356,46 +418,220 @@ llm = ChatGroq(
 )
 
 # Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index_name = PINECONE_INDEX_NAME
-if index_name not in pc.list_indexes().names():
-    pc.create_index(
-        name=index_name,
-        dimension=384,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-index = pc.Index(index_name)
+if VECTOR_BACKEND != "local":
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+    index_name = PINECONE_INDEX_NAME
+    if index_name not in pc.list_indexes().names():
+        pc.create_index(
+            name=index_name,
+            dimension=384,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1")
+        )
+    index = pc.Index(index_name)
 
 # Initialize embeddings
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that memoises embed_query() in an LRU cache.
+
+    Keys are the model name plus the lowercased, whitespace-collapsed text;
+    MiniLM is uncased, so case differences do not change the vector.
+    embed_documents() goes straight to the wrapped model (ingestion has its
+    own persistent cache).
+    """
+
+    def __init__(self, embeddings, maxsize):
+        self.embeddings = embeddings
+        self.model_name = embeddings.model_name
+        self.cached_embed = lru_cache(maxsize=maxsize)(self.embed_uncached)
+
+    def embed_uncached(self, model_name, text):
+        return tuple(self.embeddings.embed_query(text))
+
+    def embed_query(self, text):
+        return list(self.cached_embed(self.model_name, " ".join(text.lower().split())))
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        info = self.cached_embed.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            "entries": info.currsize,
+            "max_entries": info.maxsize,
+            "hits": info.hits,
+            "misses": info.misses,
+            "hit_rate": round(info.hits / lookups, 3) if lookups else 0.0
+        }
+
+# All query-time embedding (vector search, semantic lookups) goes through the cache
+query_embeddings = CachedQueryEmbeddings(embeddings, QUERY_EMBEDDING_CACHE_SIZE)
+
+class LocalVectorStore(VectorStore):
+    """In-process alternative to Pinecone for the HR_docs corpus.
+
+    Chunk vectors are L2-normalised float32 rows of one matrix, saved as
+    .npy and memory-mapped; cosine top-k is a dot product plus argpartition.
+    Chunk text and metadata are kept in records.pkl next to the matrix.
+    Each generation is published by swapping a single (matrix, documents,
+    version, facets) tuple, so searches in flight keep the one they started
+    with. Searches accept the same metadata filters as Pinecone ($eq / $in on
+    source and type), applied before scoring.
+    """
+
+    def __init__(self, embedding, folder):
+        self.embedding = embedding
+        self.folder = folder
+        self.records_path = os.path.join(folder, "records.pkl")
+        self.state = None
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @property
+    def version(self):
+        state = self.state
+        return state[2] if state is not None else None
+
+    def load(self):
+        """Map the persisted index into memory; returns False if there is none usable."""
+        try:
+            with open(self.records_path, 'rb') as f:
+                records = pickle.load(f)
+            if records.get("layout") != LOCAL_VECTOR_LAYOUT_VERSION:
+                logging.info("♻️ Local vector index is from an older layout - rebuilding")
+                return False
+            matrix = np.load(os.path.join(self.folder, records["vectors_file"]), mmap_mode='r')
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.warning(f"⚠️ Could not load local vector index, rebuilding: {e}")
+            return False
+        documents = chunk_documents(records["chunks"])
+        self.state = (matrix, documents, records["version"], metadata_facets(documents))
+        logging.info(f"✅ Local vector index loaded with {matrix.shape[0]} vectors")
+        return True
+
+    def publish(self, vectors, chunks, version):
+        """Normalise, persist and swap in a new generation of vectors."""
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(chunks), -1) if chunks else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        # A fresh file per generation: the previous one may still be mapped by readers
+        os.makedirs(self.folder, exist_ok=True)
+        vectors_file = f"vectors-{version[:16]}.npy"
+        vectors_path = os.path.join(self.folder, vectors_file)
+        with open(vectors_path + '.tmp', 'wb') as f:
+            np.save(f, matrix)
+        os.replace(vectors_path + '.tmp', vectors_path)
+        with open(self.records_path + '.tmp', 'wb') as f:
+            pickle.dump({
+                "layout": LOCAL_VECTOR_LAYOUT_VERSION,
+                "version": version,
+                "vectors_file": vectors_file,
+                "chunks": chunks
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.records_path + '.tmp', self.records_path)
+
+        documents = chunk_documents(chunks)
+        self.state = (np.load(vectors_path, mmap_mode='r'), documents, version, metadata_facets(documents))
+
+        for filename in os.listdir(self.folder):
+            if filename.startswith("vectors-") and filename != vectors_file:
+                try:
+                    os.remove(os.path.join(self.folder, filename))
+                except OSError:
+                    pass  # Still mapped (Windows); removed on a later publish
+
+    def search_vectors(self, query_vectors, k, filter=None):
+        """Batched cosine top-k: one list of (document, score) per query vector.
+
+        filter is a Pinecone-style metadata filter; only matching rows are scored.
+        """
+        state = self.state
+        if state is None or state[0].shape[0] == 0 or k <= 0:
+            return [[] for _ in query_vectors]
+        matrix, documents, _, facets = state
+        rows = None
+        if filter:
+            rows = np.flatnonzero(metadata_filter_mask(facets, matrix.shape[0], filter))
+            if rows.size == 0:
+                return [[] for _ in query_vectors]
+            matrix = matrix[rows]
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        scores = (queries / np.where(norms == 0, 1, norms)) @ matrix.T
+        k = min(k, matrix.shape[0])
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind='stable')]
+            doc_ids = top if rows is None else rows[top]
+            results.append([(documents[doc_id], float(row[i])) for doc_id, i in zip(doc_ids, top)])
+        return results
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.search_vectors([self.embedding.embed_query(query)], k, filter)[0]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, folder=None, **kwargs):
+        """Embed texts and publish them as a store in folder (a new temporary folder by default).
+
+        The app's own index is built by sync_local_vector_index(); this is the
+        generic LangChain entry point, so it never writes to LOCAL_VECTOR_FOLDER
+        unless asked to.
+        """
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        chunks = [{"id": vector_id, "text": text, "metadata": dict(metadata)}
+                  for vector_id, text, metadata in zip(ids, texts, metadatas)]
+        store = cls(embedding, folder or tempfile.mkdtemp(prefix="local_vectors-"))
+        version = hashlib.sha256(json.dumps([[chunk["id"], chunk["text"]] for chunk in chunks]).encode('utf-8')).hexdigest()
+        store.publish(embedding.embed_documents(texts), chunks, version)
+        return store
+
+local_vector_store = LocalVectorStore(query_embeddings, LOCAL_VECTOR_FOLDER)
 
 # Initialize vector store
 vectorstore = None
-try:
-    from langchain_pinecone import PineconeVectorStore as NewPineconeVectorStore
-    vectorstore = NewPineconeVectorStore(
-        index=index,
-        embedding=embeddings,
-        text_key="text"
-    )
-    logging.info("✅ Using new langchain-pinecone vectorstore")
-except ImportError:
-    # Fallback to old import if new package not available
+if VECTOR_BACKEND == "local":
+    # Loaded or built by initialize_vector_store() at startup
+    vectorstore = local_vector_store
+    logging.info("✅ Using local in-process vector index")
+else:
     try:
-        from langchain_community.vectorstores import Pinecone as PineconeVectorStore
-        vectorstore = PineconeVectorStore(
+        from langchain_pinecone import PineconeVectorStore as NewPineconeVectorStore
+        vectorstore = NewPineconeVectorStore(
             index=index,
-            embedding=embeddings,
+            embedding=query_embeddings,
             text_key="text"
         )
-        logging.info("✅ Using old langchain-community vectorstore")
+        logging.info("✅ Using new langchain-pinecone vectorstore")
+    except ImportError:
+        # Fallback to old import if new package not available
+        try:
+            from langchain_community.vectorstores import Pinecone as PineconeVectorStore
+            vectorstore = PineconeVectorStore(
+                index=index,
+                embedding=query_embeddings,
+                text_key="text"
+            )
+            logging.info("✅ Using old langchain-community vectorstore")
+        except Exception as e:
+            logging.error(f"❌ Error initializing vectorstore: {e}")
+            vectorstore = None
     except Exception as e:
-        logging.error(f"❌ Error initializing vectorstore: {e}")
+        logging.error(f"❌ Error initializing new vectorstore: {e}")
         vectorstore = None
-except Exception as e:
-    logging.error(f"❌ Error initializing new vectorstore: {e}")
-    vectorstore = None
 
 # Initialize database
 DATABASE_NAME = 'combined_db.db'
@@ -437,6 +673,8 @@ def init_db():
             retrieved_docs TEXT,
             final_answer TEXT,
             feedback TEXT,
+            index_version TEXT,
+            source_answer_id INTEGER,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -519,6 +757,21 @@ def init_db():
         if 'over_under_qualification' not in columns:
             cursor.execute('ALTER TABLE evaluations ADD COLUMN over_under_qualification TEXT')
             print("Added over_under_qualification column to evaluations")
+
+        # Policy answers record the index version they were generated against (semantic answer cache)
+        cursor.execute("PRAGMA table_info(qa_history)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        if 'index_version' not in columns:
+            cursor.execute('ALTER TABLE qa_history ADD COLUMN index_version TEXT')
+            print("Added index_version column to qa_history")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_qa_history_index_version ON qa_history(index_version)')
+
+        # Answers served from the semantic cache point at the qa_history row they reused
+        if 'source_answer_id' not in columns:
+            cursor.execute('ALTER TABLE qa_history ADD COLUMN source_answer_id INTEGER')
+            print("Added source_answer_id column to qa_history")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_qa_history_source_answer_id ON qa_history(source_answer_id)')
     except Exception as e:
         print(f"Note: Schema update check: {e}")
     
@@ -870,16 +1123,126 @@ IDENTITY_QUESTIONS = [
     "what is your name?", "who built you??", "who made you?!",
 ]
 
-def handle_special_queries(question):
-    """Handle greetings and identity-related questions."""
-    question_lower = question.lower().strip("?!. ")
-    
+# Declared holidays (static list provided by HR); also loaded into the policy table store
+HOLIDAY_YEAR = "2025"
+HOLIDAY_TABLE_SOURCE = f"Company Holidays {HOLIDAY_YEAR}"
+HOLIDAY_TABLES = [
+    {
+        "title": "India Office Holidays (Bangalore/APAC & EU, Hyderabad, Mumbai, Delhi)",
+        "headers": ["Date", "Day", "Bangalore/APAC & EU", "Hyderabad", "Mumbai", "Delhi"],
+        "rows": [
+            ["1-Jan-2025", "Wednesday", "New Year", "New Year", "New Year", "New Year"],
+            ["14-Jan-2025", "Tuesday", "Pongal/ Makar Sankranti", "Pongal/ Makar Sankranti", "Pongal/ Makar Sankranti", "Pongal/ Makar Sankranti"],
+            ["14-Mar-2025", "Friday", "-", "Holi", "Holi", "Holi"],
+            ["31-Mar-2025", "Monday", "Ramzan (Id Ul Fitr)", "Ramzan (Id Ul Fitr)", "Ramzan (Id Ul Fitr)", "-"],
+            ["18-Apr-2025", "Friday", "Good Friday", "-", "-", "Good Friday"],
+            ["1-May-2025", "Thursday", "May Day", "May Day", "May Day", "May Day"],
+            ["15-Aug-2025", "Friday", "Independence Day", "Independence Day", "Independence Day", "Independence Day"],
+            ["27-Aug-2025", "Wednesday", "Ganesh Chaturthi", "Ganesh Chaturthi", "Ganesh Chaturthi", "Ganesh Chaturthi"],
+            ["2-Oct-2025", "Thursday", "Gandhi Jayanthi/Dasara", "Gandhi Jayanthi/Dasara", "Gandhi Jayanthi/Dasara", "Gandhi Jayanthi/Dasara"],
+            ["20-Oct-2025", "Monday", "Diwali-Naraka Chaturdashi", "Diwali-Naraka Chaturdashi", "Diwali-Naraka Chaturdashi", "Diwali-Naraka Chaturdashi"],
+            ["25-Dec-2025", "Thursday", "Christmas", "Christmas", "Christmas", "Christmas"],
+        ]
+    },
+    {
+        "title": "Global Services - US Holidays",
+        "headers": ["Date", "Day", "Holiday"],
+        "rows": [
+            ["1-Jan-2025", "Wednesday", "New Year"],
+            ["18-Apr-2025", "Friday", "Good Friday"],
+            ["26-May-2025", "Monday", "Memorial Day"],
+            ["4-Jul-2025", "Friday", "Independence Day"],
+            ["1-Sep-2025", "Monday", "Labour Day"],
+            ["20-Oct-2025", "Monday", "Diwali"],
+            ["27-Nov-2025", "Thursday", "Thanksgiving"],
+            ["28-Nov-2025", "Friday", "Day after Thanksgiving"],
+            ["24-Dec-2025", "Wednesday", "Christmas Eve"],
+            ["25-Dec-2025", "Thursday", "Christmas Day"],
+        ]
+    },
+]
+
+# --- Query Preprocessing ---
+# Acronyms, greetings and identity phrases are compiled once at startup so each
+# question is expanded and classified in one pass instead of ~100 substring scans.
+def compile_phrase_pattern(phrases):
+    """Regex source matching any of the phrases, factored as a trie so each position
+    is tested against shared prefixes instead of every phrase in turn."""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}  # end of a phrase
+
+    def to_regex(node):
+        branches = [
+            (r"\s+" if char == " " else re.escape(char)) + to_regex(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        # Greedy optional group: longer phrases win over their own prefixes
+        return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+    return to_regex(trie)
+
+def normalize_phrase(text):
+    """Lowercase and reduce text to single-spaced words, for exact phrase matching."""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+ACRONYM_EXPANSIONS = {normalize_phrase(acronym): full_form.lower() for acronym, full_form in ACRONYM_MAP.items()}
+# Word boundaries stop "od" firing inside "good" or "pet" inside "competency", and
+# the optional plural "s" keeps "leaves" -> "leave policy" working
+ACRONYM_PATTERN = re.compile(r"\b(" + compile_phrase_pattern(ACRONYM_EXPANSIONS) + r")s?\b")
+
+GREETING_SET = frozenset(normalize_phrase(greeting) for greeting in GREETINGS)
+IDENTITY_SET = frozenset(normalize_phrase(phrase) for phrase in IDENTITY_QUESTIONS)
+IDENTITY_PATTERN = re.compile(r"\b" + compile_phrase_pattern(IDENTITY_SET) + r"\b")
+
+@dataclass(frozen=True)
+class PreprocessedQuery:
+    """A question after acronym expansion, with the intent detected for routing."""
+    text: str        # lowercased question with acronyms expanded (used for retrieval)
+    normalized: str  # words only, single-spaced (used for phrase matching)
+    intent: str      # "greeting", "identity", "holiday" or "policy"
+
+def expand_acronyms(question):
+    """Expand HR-related acronyms in the question."""
+    return ACRONYM_PATTERN.sub(
+        lambda match: ACRONYM_EXPANSIONS[" ".join(match.group(1).split())], question.lower()
+    )
+
+def detect_intent(normalized):
+    """Classify a normalized question; exact-match sets first, then whole-phrase search."""
+    if normalized in GREETING_SET:
+        return "greeting"
+    if normalized in IDENTITY_SET or IDENTITY_PATTERN.search(normalized):
+        return "identity"
+    if "holiday" in normalized:
+        return "holiday"
+    return "policy"
+
+def preprocess_query(question):
+    """Expand acronyms and detect the intent of a question."""
+    normalized = normalize_phrase(question)
+    return PreprocessedQuery(expand_acronyms(question), normalized, detect_intent(normalized))
+
+def handle_special_queries(query, bm25):
+    """Answer greetings, identity and holiday questions without retrieval; None otherwise.
+
+    bm25 is the BM25Snapshot captured by the caller, for holiday table lookups.
+    """
+    question_lower = query.normalized
+
     # Handle greetings
-    if question_lower in GREETINGS:
+    if query.intent == "greeting":
         return f"Hello! I'm {BOT_INFO['name']}, your HR assistant. How can I help you today?"
     
     # Handle identity questions
-    if any(q in question_lower for q in IDENTITY_QUESTIONS):
+    if query.intent == "identity":
         if "who" in question_lower or "what is your name" in question_lower:
             return f"I'm {BOT_INFO['name']}, an AI assistant built by {BOT_INFO['creator']}. {BOT_INFO['responsibility']}"
         elif "created" in question_lower or "built" in question_lower:
@@ -890,45 +1253,20 @@ def handle_special_queries(question):
             return f"I'm {BOT_INFO['name']}, an AI assistant created by {BOT_INFO['creator']}. {BOT_INFO['capabilities']}"
 
     # Handle holiday list queries (static 2025 list provided by HR)
-    if "holiday" in question_lower or "holidays" in question_lower:
-        year = "2025"
-        header = f"## Company Holidays {year}\n\nBelow are the declared holidays for {year}.\n\n"
-
-        india_table = (
-            "### India Offices (Bangalore/APAC & EU, Hyderabad, Mumbai, Delhi)\n"
-            "| Date | Day | Bangalore/APAC & EU | Hyderabad | Mumbai | Delhi |\n"
-            "|------|-----|----------------------|-----------|--------|-------|\n"
-            "| 1-Jan-2025 | Wednesday | New Year | New Year | New Year | New Year |\n"
-            "| 14-Jan-2025 | Tuesday | Pongal/ Makar Sankranti | Pongal/ Makar Sankranti | Pongal/ Makar Sankranti | Pongal/ Makar Sankranti |\n"
-            "| 14-Mar-2025 | Friday | - | Holi | Holi | Holi |\n"
-            "| 31-Mar-2025 | Monday | Ramzan (Id Ul Fitr) | Ramzan (Id Ul Fitr) | Ramzan (Id Ul Fitr) | - |\n"
-            "| 18-Apr-2025 | Friday | Good Friday | - | - | Good Friday |\n"
-            "| 1-May-2025 | Thursday | May Day | May Day | May Day | May Day |\n"
-            "| 15-Aug-2025 | Friday | Independence Day | Independence Day | Independence Day | Independence Day |\n"
-            "| 27-Aug-2025 | Wednesday | Ganesh Chaturthi | Ganesh Chaturthi | Ganesh Chaturthi | Ganesh Chaturthi |\n"
-            "| 2-Oct-2025 | Thursday | Gandhi Jayanthi/Dasara | Gandhi Jayanthi/Dasara | Gandhi Jayanthi/Dasara | Gandhi Jayanthi/Dasara |\n"
-            "| 20-Oct-2025 | Monday | Diwali-Naraka Chaturdashi | Diwali-Naraka Chaturdashi | Diwali-Naraka Chaturdashi | Diwali-Naraka Chaturdashi |\n"
-            "| 25-Dec-2025 | Thursday | Christmas | Christmas | Christmas | Christmas |\n"
-        )
-
-        us_table = (
-            "\n### Global Services - US\n"
-            "| Date | Day | Holiday |\n"
-            "|------|-----|---------|\n"
-            "| 1-Jan-2025 | Wednesday | New Year |\n"
-            "| 18-Apr-2025 | Friday | Good Friday |\n"
-            "| 26-May-2025 | Monday | Memorial Day |\n"
-            "| 4-Jul-2025 | Friday | Independence Day |\n"
-            "| 1-Sep-2025 | Monday | Labour Day |\n"
-            "| 20-Oct-2025 | Monday | Diwali |\n"
-            "| 27-Nov-2025 | Thursday | Thanksgiving |\n"
-            "| 28-Nov-2025 | Friday | Day after Thanksgiving |\n"
-            "| 24-Dec-2025 | Wednesday | Christmas Eve |\n"
-            "| 25-Dec-2025 | Thursday | Christmas Day |\n"
+    if query.intent == "holiday":
+        # Questions about particular holidays or offices get just that part, from the table store
+        table_answer = answer_from_policy_tables(query.text, bm25, sources={HOLIDAY_TABLE_SOURCE},
+                                                 require_cue=False, min_terms=1, min_score=0)
+        if table_answer:
+            return table_answer
+
+        header = f"## Company Holidays {HOLIDAY_YEAR}\n\nBelow are the declared holidays for {HOLIDAY_YEAR}.\n\n"
+        tables = "\n\n".join(
+            f"### {table['title']}\n{render_markdown_table(table['headers'], [list(column) for column in zip(*table['rows'])])}"
+            for table in HOLIDAY_TABLES
         )
-
-        footnote = "\n> Note: If a holiday falls on a weekend, local HR guidelines on compensatory off apply."
-        return header + india_table + us_table + footnote
+        footnote = "\n\n> Note: If a holiday falls on a weekend, local HR guidelines on compensatory off apply."
+        return header + tables + footnote
     
     return None
 
@@ -1369,6 +1707,7 @@ def ask_question():
         data = request.get_json()
         question = data.get('question')
         online_mode = data.get('online_mode', False)
+        bypass_cache = bool(data.get('bypass_cache', False))
 
         if not question:
             return jsonify({'error': 'No question provided'}), 400
@@ -1376,17 +1715,69 @@ def ask_question():
         def generate():
             complete_response = []  # Store complete response
             try:
-                # Check for special queries first
-                special_response = handle_special_queries(question)
+                # Capture the snapshot once so a concurrent rebuild cannot mix versions: routing,
+                # table answers, cache keys and retrieval all see the same index
+                bm25 = bm25_snapshot
+                index_version = bm25.version if bm25 is not None else None
+
+                # Expand acronyms and detect greetings/identity/holiday questions in one pass
+                query = preprocess_query(question)
+                special_response = handle_special_queries(query, bm25)
                 if special_response:
                     complete_response.append(special_response)
                     yield special_response
                     return
 
-                # Expand acronyms in the question
-                expanded_question = expand_acronyms(question)
+                expanded_question = query.text
 
-                if online_mode:
+                # Small talk, table lookups and out-of-scope questions are routed locally before any
+                # retrieval or Gemini call; everything else (and anything unsure) takes the usual path
+                decision = intent_router.classify(expanded_question, bm25)
+                if decision.route == "static":
+                    intent_router.record(question, decision, True)
+                    static_reply = STATIC_REPLIES[decision.intent]
+                    complete_response.append(static_reply)
+                    yield static_reply
+                    return
+                direct_answer = None
+                if not online_mode:
+                    if decision.route == "online":
+                        direct_answer = OUT_OF_SCOPE_REPLY.format(question=question.strip())
+                    else:
+                        # Table lookups need a cue word ("table", "scale") unless the router picked them
+                        # out; either way the table's own title/columns must match the question
+                        direct_answer = answer_from_policy_tables(expanded_question, bm25,
+                                                                  require_cue=decision.route != "table")
+                intent_router.record(question, decision, direct_answer is not None)
+
+                # Repeated questions against the same index version are answered from the cache
+                cache_key = answer_cache_key(expanded_question, online_mode, index_version)
+                answer_cacheable = direct_answer is None
+                answer_index_version = None  # Set when a fresh policy answer may seed the semantic cache
+                source_answer_id = None  # qa_history row reused by a semantic cache hit
+                if direct_answer is not None:
+                    cached_answer = None
+                elif bypass_cache:
+                    answer_cache.record_bypass()
+                    if not online_mode:
+                        semantic_answer_cache.record_bypass()
+                    cached_answer = None
+                else:
+                    cached_answer = answer_cache.get(cache_key)
+                    # Paraphrases of earlier, not badly rated policy answers skip retrieval and Gemini
+                    if cached_answer is None and not online_mode:
+                        semantic_hit = semantic_answer_cache.lookup(expanded_question, index_version)
+                        if semantic_hit is not None:
+                            source_answer_id, cached_answer = semantic_hit
+
+                if direct_answer is not None:
+                    complete_response.append(direct_answer)
+                    yield direct_answer
+                elif cached_answer is not None:
+                    logging.info(f"⚡ Answer cache hit for: {cache_key[0][:80]}")
+                    complete_response.append(cached_answer)
+                    yield cached_answer
+                elif online_mode:
                     # ONLINE MODE: Answer any general question using LLM knowledge
                     # No RAG constraints - can answer anything
                     detailed_prompt = f"""You are an expert AI assistant. Provide a comprehensive and detailed answer to the following question. Your response should be thorough, well-structured, and accurate.
@@ -1401,100 +1792,25 @@ def ask_question():
                     5. If you're uncertain about specific facts, mention that
                     """
                     
-                    response = model.generate_content(detailed_prompt, stream=True)
-                    for chunk in response:
-                        if chunk.text:
-                            complete_response.append(chunk.text)
-                            yield chunk.text
+                    for text in stream_gemini_answer(detailed_prompt):
+                        complete_response.append(text)
+                        yield text
                 else:
                     # RAG MODE: Strict retrieval from local documents only
-                    # Use hybrid search (BM25 + Vector) for better coverage
-                    
-                    # Step 1: Hybrid retrieval - combine BM25 and Vector search
-                    all_retrieved_docs = []
-                    
-                    # Vector search (semantic similarity) - increased k for better coverage
-                    if vectorstore is not None:
-                        vector_docs = vectorstore.similarity_search(expanded_question, k=15)
-                        all_retrieved_docs.extend([(doc, 'vector') for doc in vector_docs])
-                        logging.info(f"🔍 Vector search retrieved {len(vector_docs)} documents")
-                    
-                    # BM25 search (keyword matching) - better for exact terms and tables
-                    if bm25_index and bm25_corpus:
-                        try:
-                            query_tokens = expanded_question.lower().split()
-                            bm25_scores = bm25_index.get_scores(query_tokens)
-                            
-                            # Get top BM25 results - increased k for better coverage
-                            top_indices = sorted(range(len(bm25_scores)), key=lambda i: bm25_scores[i], reverse=True)[:10]
-                            bm25_results = []
-                            for idx in top_indices:
-                                if bm25_scores[idx] > 0:  # Only include relevant results
-                                    text_content = " ".join(bm25_corpus[idx])
-                                    # Create a Document-like object with metadata for consistency
-                                    from langchain_core.documents import Document as LangchainDocument
-                                    # Get metadata for this chunk if available
-                                    metadata = bm25_metadata[idx] if idx < len(bm25_metadata) else {}
-                                    bm25_doc = LangchainDocument(page_content=text_content, metadata=metadata)
-                                    bm25_results.append(bm25_doc)
-                                    all_retrieved_docs.append((bm25_doc, 'bm25'))
-                            
-                            logging.info(f"🔍 BM25 search retrieved {len(bm25_results)} documents")
-                        except Exception as e:
-                            logging.warning(f"⚠️ BM25 search failed: {e}")
-                    
-                    # Step 2: Deduplicate and prioritize
-                    seen_content = set()
-                    unique_docs = []
-                    table_docs = []
-                    text_docs = []
-                    
-                    for doc, source in all_retrieved_docs:
-                        content_hash = hash(doc.page_content[:100])  # Hash first 100 chars for dedup
-                        if content_hash not in seen_content:
-                            seen_content.add(content_hash)
-                            # Classify as table or text
-                            if "[TABLE DATA]" in doc.page_content or ("|" in doc.page_content and doc.page_content.count("|") > 3):
-                                table_docs.append(doc)
-                            else:
-                                text_docs.append(doc)
-                            unique_docs.append(doc)
-                    
-                    # Step 3: Prioritize tables and limit context window
-                    # Tables first (they're often most precise), then text chunks
-                    prioritized_docs = table_docs + text_docs
-                    context_docs = prioritized_docs[:12]  # Take top 12 for context
-                    
-                    # Step 4: Build context with proper source citations (filename + page)
-                    if context_docs:
-                        context_parts = []
-                        for i, doc in enumerate(context_docs):
-                            # Extract actual source filename and page from metadata
-                            source_name = doc.metadata.get('source', 'Unknown Document') if hasattr(doc, 'metadata') and doc.metadata else 'Unknown Document'
-                            page_num = doc.metadata.get('page', 'N/A') if hasattr(doc, 'metadata') and doc.metadata else 'N/A'
-                            
-                            # Format citation with actual filename
-                            if source_name != 'Unknown Document':
-                                citation = f"{source_name}"
-                                if page_num != 'N/A':
-                                    citation += f", page {page_num}"
-                            else:
-                                citation = f"Source {i+1}"
-                            
-                            # Add relevance indicator for tables with proper citation
-                            if doc in table_docs:
-                                context_parts.append(f"[RELEVANT TABLE DATA - {citation}]\n{doc.page_content}")
-                            else:
-                                context_parts.append(f"[RELEVANT CONTEXT - {citation}]\n{doc.page_content}")
-                        context = "\n\n---\n\n".join(context_parts)
-                        
-                        # Log retrieval stats
-                        logging.info(f"📚 Total unique documents retrieved: {len(unique_docs)} ({len(table_docs)} tables, {len(text_docs)} text)")
-                        if table_docs:
-                            logging.info(f"📊 Including {len(table_docs)} table chunks in context")
+                    retrieval_key = retrieval_cache_key(expanded_question, bm25)
+                    retrieval = retrieval_cache.get(retrieval_key)
+                    if retrieval is None:
+                        retrieval = retrieve_policy_context(expanded_question, bm25)
+                        # Results missing a timed-out leg are used once, never cached
+                        if retrieval["context"] and retrieval["complete"]:
+                            retrieval_cache.put(retrieval_key, retrieval)
                     else:
-                        context = ""
-                        logging.warning("⚠️ No documents retrieved from knowledge base")
+                        logging.info(f"⚡ Retrieval cache hit: {len(retrieval['sources'])} chunks "
+                                     f"({retrieval['tables']} tables, ~{retrieval['context_tokens']} tokens)")
+                    context = retrieval["context"]
+                    answer_cacheable = retrieval["complete"]
+                    if context and answer_cacheable and bm25 is not None:
+                        answer_index_version = bm25.version
                     
                     # Step 5: Enhanced RAG prompt with strict enforcement
                     if context:
@@ -1587,27 +1903,28 @@ def ask_question():
                     3. Contact HR for company-specific policies not yet in the system"""
                         
                         # Still generate response but with this constraint
-                        response = model.generate_content(prompt, stream=True)
-                        for chunk in response:
-                            if chunk.text:
-                                complete_response.append(chunk.text)
-                                yield chunk.text
+                        for text in stream_gemini_answer(prompt):
+                            complete_response.append(text)
+                            yield text
                         return
                     
-                    response = model.generate_content(prompt, stream=True)
-                    for chunk in response:
-                        if chunk.text:
-                            complete_response.append(chunk.text)
-                            yield chunk.text
+                    for text in stream_gemini_answer(prompt):
+                        complete_response.append(text)
+                        yield text
 
                 # Store the complete Q&A in history after streaming is done
                 final_answer = "".join(complete_response)
+                if cached_answer is None and answer_cacheable and final_answer:
+                    answer_cache.put(cache_key, final_answer)
                 conn = sqlite3.connect('combined_db.db')
                 c = conn.cursor()
-                c.execute('''INSERT INTO qa_history (question, retrieved_docs, final_answer)
-                            VALUES (?, ?, ?)''', (question, None, final_answer))
+                c.execute('''INSERT INTO qa_history (question, retrieved_docs, final_answer, index_version, source_answer_id)
+                            VALUES (?, ?, ?, ?, ?)''', (question, None, final_answer, answer_index_version, source_answer_id))
+                question_id = c.lastrowid
                 conn.commit()
                 conn.close()
+                if answer_index_version is not None and final_answer:
+                    semantic_answer_cache.add(question_id, expanded_question, final_answer, answer_index_version)
 
             except Exception as e:
                 error_msg = f"Error: {str(e)}"
@@ -1628,18 +1945,52 @@ def ask_question():
 
 @app.route("/api/update_index", methods=["POST"])
 def update_index_api():
-    """Manually refresh the Pinecone & BM25 index."""
+    """Start a background refresh of the Pinecone & BM25 index.
+
+    Returns 202 with a job_id to poll at /api/update_index/status/<job_id>.
+    If a reindex is already running its job_id is returned instead; a full
+    rebuild requested during an incremental reindex is queued to run after it.
+    """
     try:
-        # Rebuild BM25 index
-        build_bm25_index(POLICIES_FOLDER)
-        
-        # Repopulate Pinecone
-        populate_pinecone_index()
-        
-        return jsonify({"message": "Indexes updated successfully"}), 200
+        data = request.get_json(silent=True) or {}
+        job_id, outcome = start_reindex_job(full_rebuild=bool(data.get("full_rebuild", False)))
+        return jsonify({
+            "message": {
+                "started": "Index update started",
+                "joined": "Index update already in progress",
+                "queued": "Full rebuild queued after the index update in progress"
+            }[outcome],
+            "job_id": job_id,
+            "coalesced": outcome == "joined",
+            "queued": outcome == "queued",
+            "status_url": f"/api/update_index/status/{job_id}"
+        }), 202
     except Exception as e:
         logging.error(f"❌ Index Update Error: {e}", exc_info=True)
-        return jsonify({"error": "Failed to update indexes"}), 500
+        return jsonify({"error": "Failed to start index update"}), 500
+
+@app.route("/api/update_index/status/<job_id>", methods=["GET"])
+def update_index_status_api(job_id):
+    """Report phase, progress counters, errors and duration of a reindex job."""
+    job = get_reindex_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job_id"}), 404
+    return jsonify(job), 200
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats_api():
+    """Hit/miss counters for the /api/ask caches."""
+    return jsonify({
+        "answer_cache": answer_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "semantic_answer_cache": semantic_answer_cache.stats(),
+        "query_embeddings": query_embeddings.stats()
+    }), 200
+
+@app.route("/api/intent_router/stats", methods=["GET"])
+def intent_router_stats_api():
+    """Intent router decisions and the Gemini calls they avoided."""
+    return jsonify(intent_router.stats()), 200
 
 # Resume Evaluator Routes
 async def async_gemini_generate(prompt):
@@ -2177,7 +2528,7 @@ def submit_feedback():
                 
                 # Get question_id from qa_history
                 cursor.execute("""
-                    SELECT id FROM qa_history 
+                    SELECT id, source_answer_id FROM qa_history 
                     WHERE question = ? 
                     ORDER BY timestamp DESC 
                     LIMIT 1
@@ -2190,9 +2541,9 @@ def submit_feedback():
                         INSERT INTO qa_history (question, final_answer)
                         VALUES (?, ?)
                     """, (data['question'], ''))
-                    question_id = cursor.lastrowid
+                    question_id, source_answer_id = cursor.lastrowid, None
                 else:
-                    question_id = result[0]
+                    question_id, source_answer_id = result
                 
                 # Check if feedback already exists for this question
                 cursor.execute("SELECT id FROM qa_feedback WHERE question_id = ?", (question_id,))
@@ -2204,6 +2555,14 @@ def submit_feedback():
                     INSERT INTO qa_feedback (question_id, rating, feedback, timestamp)
                     VALUES (?, ?, ?, datetime('now'))
                 """, (question_id, data['rating'], data.get('feedback', '')))
+
+                # A badly rated answer is no longer offered to paraphrased questions; for a reply
+                # served from the semantic cache, that is the earlier answer it reused
+                try:
+                    if int(data['rating']) < SEMANTIC_CACHE_MIN_RATING:
+                        semantic_answer_cache.discard(source_answer_id or question_id)
+                except (TypeError, ValueError):
+                    pass
                 
             else:
                 # Handle resume evaluation feedback
@@ -2237,218 +2596,370 @@ def submit_feedback():
         logging.error(f"Error in submit_feedback: {str(e)}")
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
-# --- Document Processing ---
-# Optimized chunking for HR policy documents:
-# - Larger chunks (1200) preserve context and complete policy explanations
-# - Higher overlap (250) ensures continuity across chunks
-# - Better separators prioritize paragraph/sentence boundaries
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1200,        # Increased from 400 for better context retention
-    chunk_overlap=250,      # Increased from 50 (20% overlap for continuity)
-    separators=["\n\n", "\n", ". ", " ", ""]  # Better paragraph/sentence awareness
-)
+# --- Incremental Index Manifest ---
+# The manifest records, for every policy PDF, the sha256 of the file and a hash
+# of each page's extracted text and tables, together with the chunks and vector
+# IDs produced from that page. Reindexing compares against it so only new or
+# changed pages are re-extracted and re-embedded.
+
+def file_sha256(path):
+    """Return the hex sha256 digest of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_index_manifest():
+    """Load the HR_docs index manifest, or None if it is missing or from an older layout."""
+    try:
+        with open(INDEX_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('backend', 'pinecone') != VECTOR_BACKEND:
+            # The manifest describes what the other backend holds; this one needs a full sync
+            logging.info(f"♻️ Index manifest was written for the {manifest.get('backend', 'pinecone')} backend - ignoring it")
+            return None
+        if manifest.get('version') == INDEX_MANIFEST_VERSION and isinstance(manifest.get('files'), dict):
+            return manifest
+        logging.warning("⚠️ Index manifest is from an older version - ignoring it")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"⚠️ Could not read index manifest, ignoring it: {e}")
+    return None
 
-def dataframe_to_clean_markdown(df: pd.DataFrame) -> str:
-    """Convert a pandas DataFrame into a clean GitHub-flavored markdown table.
+def save_index_manifest(manifest):
+    """Atomically write the index manifest to disk."""
+    os.makedirs(INDEX_CACHE_FOLDER, exist_ok=True)
+    tmp_path = INDEX_MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(manifest, version=INDEX_MANIFEST_VERSION, backend=VECTOR_BACKEND), f, ensure_ascii=False)
+    os.replace(tmp_path, INDEX_MANIFEST_PATH)
 
-    - Fills missing/None headers with generic names (Column 1, Column 2, ...)
-    - Collapses multi-line cell content into single lines
-    - Ensures string-typed cells
-    - Removes the index column from the markdown output
+def extract_policy_files(jobs, progress=None):
+    """Extract several PDFs, spreading them over a process pool when INGEST_WORKERS > 1.
+
+    jobs is a list of (filename, pdf_path, previous_pages). Returns
+    {filename: (pages, changed_pages)} and logs per-file timings. progress,
+    if given, is called as progress(file_done=filename) after each file.
     """
-    try:
-        # Defensive copy
-        table_df = df.copy()
-
-        # Normalize headers
-        normalized_columns = []
-        for i, col in enumerate(table_df.columns):
-            col_str = str(col).strip() if col is not None else ""
-            if col_str == "" or col_str.lower() == "none":
-                col_str = f"Column {i+1}"
-            normalized_columns.append(col_str)
-        table_df.columns = normalized_columns
-
-        # Drop index-like first column if it looks like 0..N sequence
-        if table_df.shape[1] > 0:
-            first_col_vals = list(table_df.iloc[:, 0])
-            def looks_like_sequential_index(vals):
-                try:
-                    ints = [int(str(v)) for v in vals]
-                    return ints == list(range(len(ints)))
-                except Exception:
-                    return False
-            if looks_like_sequential_index(first_col_vals):
-                table_df = table_df.iloc[:, 1:]
-
-        # Drop columns that are entirely empty after stripping
-        if table_df.shape[1] > 0:
-            non_empty_cols = []
-            for c in table_df.columns:
-                col_str = table_df[c].astype(str).str.strip()
-                if (col_str != "").any():
-                    non_empty_cols.append(c)
-            if non_empty_cols:
-                table_df = table_df[non_empty_cols]
-
-        # Normalize cell content: string type, collapse newlines/tabs, trim
-        for c in table_df.columns:
-            table_df[c] = (
-                table_df[c]
-                .astype(str)
-                .str.replace("\r\n|\r|\n", " ", regex=True)
-                .str.replace("\t", " ", regex=True)
-                .str.replace("\\s+", " ", regex=True)
-                .str.strip()
-            )
+    results = {}
+    workers = min(INGEST_WORKERS, len(jobs))
+    if workers > 1 and __name__ == "__main__":
+        # Spawned workers re-import the main script, which here is the whole app
+        logging.warning("⚠️ INGEST_WORKERS > 1 needs the app started from run.py - extracting serially")
+        workers = 1
+    started = time.perf_counter()
+
+    def record(filename, result):
+        pages, changed_pages, elapsed = result
+        results[filename] = (pages, changed_pages)
+        logging.info(f"📄 Extracted {filename}: {len(pages)} pages ({len(changed_pages)} changed) in {elapsed:.2f}s")
+        if progress:
+            progress(file_done=filename)
+
+    if workers > 1:
+        # Never fork: this runs on the reindex job's thread next to the retrieval pool, the
+        # server loop and torch threads. Spawned workers only import pdf_extraction.py.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {
+                pool.submit(extract_pdf_chunks_timed, pdf_path, previous_pages): filename
+                for filename, pdf_path, previous_pages in jobs
+            }
+            for future in as_completed(futures):
+                record(futures[future], future.result())
+    else:
+        for filename, pdf_path, previous_pages in jobs:
+            record(filename, extract_pdf_chunks_timed(pdf_path, previous_pages))
+
+    if jobs:
+        logging.info(f"⏱️ Extracted {len(jobs)} PDF files with {max(workers, 1)} worker(s) in {time.perf_counter() - started:.2f}s")
+    return results
+
+def scan_policy_documents(folder_path, full_rebuild=False, progress=None):
+    """Run the extraction stage over every PDF in folder_path.
+
+    Files whose sha256 matches the index manifest are not opened at all. The
+    result holds the new manifest entries ("files"), the chunks that still need
+    embedding ("new_chunks"), the vector IDs of changed, removed or deleted
+    pages ("stale_ids") and per-file counts ("summary"). Without a usable
+    manifest, or with full_rebuild=True, every file is extracted from scratch.
+    progress, if given, receives files_total and then one file_done per file.
+    """
+    manifest = None if full_rebuild else load_index_manifest()
+    full_rebuild = manifest is None
+    previous_files = manifest["files"] if manifest else {}
+    scan = {
+        "full_rebuild": full_rebuild,
+        "files": {},
+        "new_chunks": [],
+        "stale_ids": [],
+        "summary": {"unchanged_files": 0, "changed_files": 0, "deleted_files": 0, "reindexed_pages": 0}
+    }
+    summary = scan["summary"]
+
+    if not os.path.exists(folder_path):
+        logging.warning(f"Policies folder {folder_path} does not exist")
+        return scan
+
+    pdf_files = sorted(f for f in os.listdir(folder_path) if f.endswith('.pdf'))
+    if not pdf_files:
+        logging.warning(f"No PDF files found in {folder_path}")
+
+    total_files = len(pdf_files)
+    logging.info(f"📚 Checking {total_files} PDF files for changes")
+    if progress:
+        progress(files_total=total_files)
+
+    # Hash every file first; only new or modified files are extracted
+    jobs = []
+    for filename in pdf_files:
+        pdf_path = os.path.join(folder_path, filename)
+        file_hash = file_sha256(pdf_path)
+        previous = previous_files.get(filename)
+        if previous and previous.get("sha256") == file_hash:
+            scan["files"][filename] = previous
+            summary["unchanged_files"] += 1
+            if progress:
+                progress(file_done=filename)
+            continue
+        previous_pages = previous.get("pages", {}) if previous else {}
+        jobs.append((filename, pdf_path, file_hash, previous_pages))
+
+    extracted = extract_policy_files([(filename, pdf_path, previous_pages)
+                                      for filename, pdf_path, _, previous_pages in jobs], progress)
+
+    # Merge in file-name order so chunk order and IDs do not depend on worker timing
+    for filename, pdf_path, file_hash, previous_pages in jobs:
+        summary["changed_files"] += 1
+        pages, changed_pages = extracted[filename]
+        for page_key in changed_pages:
+            # Chunks whose content did not change keep their ID and are already in the index
+            previous_ids = {chunk["id"] for chunk in previous_pages.get(page_key, {}).get("chunks", [])}
+            page_chunks = [chunk for chunk in pages[page_key]["chunks"] if chunk["id"] not in previous_ids]
+            scan["new_chunks"].extend(page_chunks)
+            logging.info(f"   {filename} page {page_key}: Added {len(page_chunks)} chunks")
+        summary["reindexed_pages"] += len(changed_pages)
+
+        # Pages that were re-chunked or no longer exist in the new version of the file
+        for page_key, previous_page in previous_pages.items():
+            if page_key in changed_pages or page_key not in pages:
+                scan["stale_ids"].extend(chunk["id"] for chunk in previous_page["chunks"])
+
+        scan["files"][filename] = {"sha256": file_hash, "pages": pages}
+
+    # Files removed from the policies folder
+    for filename, previous in previous_files.items():
+        if filename not in scan["files"]:
+            summary["deleted_files"] += 1
+            for previous_page in previous.get("pages", {}).values():
+                scan["stale_ids"].extend(chunk["id"] for chunk in previous_page["chunks"])
+            logging.info(f"🗑️ {filename} was removed - its vectors will be deleted")
+
+    # IDs that are still produced by some page (same content) must not be deleted
+    live_ids = {chunk["id"] for chunk in policy_chunks(scan["files"])}
+    scan["stale_ids"] = [vector_id for vector_id in dict.fromkeys(scan["stale_ids"]) if vector_id not in live_ids]
+    return scan
+
+def policy_chunks(files):
+    """Flatten manifest file entries into the canonical chunk list.
+
+    Chunks are ordered by file name, page number and position on the page, so
+    every consumer sees the same list in the same order.
+    """
+    return [
+        chunk
+        for filename in sorted(files)
+        for page_key in sorted(files[filename]["pages"], key=int)
+        for chunk in files[filename]["pages"][page_key]["chunks"]
+    ]
 
-        # Render as markdown without index
-        return table_df.to_markdown(index=False, tablefmt="pipe")
-    except Exception as e:
-        logging.warning(f"Failed to render markdown table cleanly, falling back: {e}")
-        # Fallback to basic to_markdown if anything goes wrong
-        try:
-            return df.to_markdown(index=False, tablefmt="pipe")
-        except Exception:
-            return df.to_markdown()
+def delete_vectors(index, vector_ids):
+    """Delete vectors by ID in request-sized batches."""
+    delete_batch_size = 1000  # Pinecone limit for delete-by-ID requests
+    for i in range(0, len(vector_ids), delete_batch_size):
+        index.delete(ids=vector_ids[i:i + delete_batch_size])
 
-def process_pdf(pdf_path, documents, table_chunks):
-    """Extract text and tables from a PDF file."""
+def prune_stale_vectors(index, live_ids):
+    """Delete every vector whose ID is not in live_ids; returns the number deleted.
+
+    This removes duplicates left by earlier runs that used random IDs.
+    Listing IDs is only supported on serverless indexes.
+    """
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                # Extract and process text
-                text = page.extract_text() or ""
-                if text:
-                    text_chunks = text_splitter.split_text(text)
-                    documents.extend(text_chunks)
-                
-                # Extract and process tables
-                tables = page.extract_tables()
-                for table in tables:
-                    if table and len(table) > 1:  # Ensure table has headers and data
-                        df = pd.DataFrame(table[1:], columns=table[0])
-                        table_markdown = dataframe_to_clean_markdown(df)
-                        
-                        # Enrich table for better BM25 matching (same as Pinecone indexing)
-                        column_names = " ".join([str(col).lower() for col in df.columns if col])
-                        sample_values = []
-                        # Use positional access to avoid issues with non-standard/duplicate column labels
-                        num_sample_cols = min(3, len(df.columns))
-                        for col_idx in range(num_sample_cols):
-                            series = df.iloc[:, col_idx]
-                            sample_values.extend([str(val).lower() for val in series.dropna().head(3).tolist()])
-                        sample_context = " ".join(sample_values[:10])
-                        enriched_table = f"[TABLE DATA] Topic: {column_names} {sample_context}\n\n{table_markdown}\n\n[END TABLE]"
-                        table_chunks.append(enriched_table)
+        stale_ids = [vector_id for page in index.list() for vector_id in page if vector_id not in live_ids]
     except Exception as e:
-        logging.error(f"❌ Error processing PDF {pdf_path}: {e}")
+        logging.warning(f"⚠️ Could not list vector IDs to prune stale vectors: {e}")
+        return 0
+    if stale_ids:
+        delete_vectors(index, stale_ids)
+        logging.info(f"🧹 Pruned {len(stale_ids)} vectors that no longer belong to any chunk")
+    return len(stale_ids)
+
+# --- Embedding Cache ---
+# Chunk embeddings are cached in SQLite keyed by sha1(model name + chunk text),
+# so re-embedding unchanged text (e.g. after a full rebuild) costs no inference.
+
+def embedding_cache_key(text):
+    """Cache key for a chunk embedding under the current model."""
+    return hashlib.sha1(f"{EMBEDDING_MODEL_NAME}\n{text}".encode('utf-8')).hexdigest()
+
+def open_embedding_cache():
+    """Open the embedding cache database, creating it if needed."""
+    os.makedirs(INDEX_CACHE_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL
+        )
+    ''')
+    return conn
 
-def populate_pinecone_index():
-    """Extract content from PDF documents and populate Pinecone index."""
+def embed_documents_cached(texts):
+    """Embed texts with the shared model, serving repeats from the embedding cache."""
+    keys = [embedding_cache_key(text) for text in texts]
+    vectors = {}
+    conn = open_embedding_cache()
     try:
-        documents = []
-        table_chunks = []
-        texts = []
-        metadatas = []
-        
-        # Get all PDF files from the policies folder
-        if not os.path.exists(POLICIES_FOLDER):
-            logging.warning(f"Policies folder {POLICIES_FOLDER} does not exist")
-            return
-            
-        pdf_files = [f for f in os.listdir(POLICIES_FOLDER) if f.endswith('.pdf')]
-        if not pdf_files:
-            logging.warning(f"No PDF files found in {POLICIES_FOLDER}")
-            return
-            
-        total_files = len(pdf_files)
-        logging.info(f"📚 Processing {total_files} PDF files")
-        
-        for idx, filename in enumerate(pdf_files, 1):
-            pdf_path = os.path.join(POLICIES_FOLDER, filename)
-            logging.info(f"📄 Processing file {idx}/{total_files}: {filename}")
-            
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    text = page.extract_text() or ""
-                    if text:
-                        chunks = text_splitter.split_text(text)
-                        documents.extend(chunks)
-                        for chunk in chunks:
-                            texts.append(chunk)
-                            metadatas.append({
-                                "source": filename,
-                                "page": page_num,
-                                "type": "text"
-                            })
-                        logging.info(f"   Page {page_num}: Added {len(chunks)} text chunks")
-                    
-                    tables = page.extract_tables()
-                    for table_num, table in enumerate(tables, 1):
-                        if table and len(table) > 1:
-                            df = pd.DataFrame(table[1:], columns=table[0])
-                            table_markdown = dataframe_to_clean_markdown(df)
-                            
-                            # Improve table representation for better retrieval:
-                            # 1. Extract column names as descriptive keywords
-                            column_names = " ".join([str(col).lower() for col in df.columns if col])
-                            
-                            # 2. Extract sample data values as context
-                            sample_values = []
-                            # Use positional access to avoid issues with non-standard/duplicate column labels
-                            num_sample_cols = min(3, len(df.columns))
-                            for col_idx in range(num_sample_cols):  # First up to 3 columns
-                                series = df.iloc[:, col_idx]
-                                sample_values.extend([str(val).lower() for val in series.dropna().head(3).tolist()])
-                            sample_context = " ".join(sample_values[:10])
-                            
-                            # 3. Create enriched table chunk with context
-                            enriched_table = f"[TABLE DATA] Topic: {column_names} {sample_context}\n\n{table_markdown}\n\n[END TABLE]"
-                            table_chunks.append(enriched_table)
-                            texts.append(enriched_table)
-                            metadatas.append({
-                                "source": filename,
-                                "page": page_num,
-                                "type": "table"
-                            })
-                            logging.info(f"   Page {page_num}: Added table {table_num} (enriched with context)")
+        unique_keys = list(dict.fromkeys(keys))
+        lookup_batch_size = 500  # Stay below SQLite's host-parameter limit
+        for i in range(0, len(unique_keys), lookup_batch_size):
+            batch_keys = unique_keys[i:i + lookup_batch_size]
+            placeholders = ",".join("?" * len(batch_keys))
+            rows = conn.execute(f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", batch_keys)
+            for key, blob in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                vectors[key] = vector.tolist()
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            new_vectors = embeddings.embed_documents(list(missing.values()))
+            for key, vector in zip(missing, new_vectors):
+                vectors[key] = vector
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector) VALUES (?, ?)",
+                [(key, array('f', vector).tobytes()) for key, vector in zip(missing, new_vectors)]
+            )
+            conn.commit()
+        logging.info(f"🧠 Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} embedded")
+    finally:
+        conn.close()
+    return [vectors[key] for key in keys]
+
+def evict_embedding_cache(live_texts):
+    """Drop cached embeddings that no longer belong to any live chunk; returns the count removed."""
+    conn = open_embedding_cache()
+    try:
+        conn.execute("CREATE TEMP TABLE live_keys (key TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO live_keys (key) VALUES (?)",
+                         [(embedding_cache_key(text),) for text in live_texts])
+        removed = conn.execute("DELETE FROM embedding_cache WHERE key NOT IN (SELECT key FROM live_keys)").rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    if removed:
+        logging.info(f"🧹 Evicted {removed} cached embeddings for chunks no longer in the corpus")
+    return removed
+
+def upsert_vectors(index, records):
+    """Upsert (id, values, metadata) records in request-sized batches."""
+    for i in range(0, len(records), PINECONE_UPSERT_BATCH_SIZE):
+        index.upsert(vectors=records[i:i + PINECONE_UPSERT_BATCH_SIZE])
+
+def embed_and_upsert(index, chunks, progress=None):
+    """Embed chunk records with the shared model and upsert them into Pinecone.
+
+    Upserts run on a background thread while the next batch is embedded, so
+    model inference and network I/O overlap. At most one batch is in flight,
+    which bounds memory and surfaces upload errors promptly. progress, if
+    given, receives batches_total and then batch_done/chunks_done per batch
+    once its upsert has finished.
+    """
+    total_batches = (len(chunks) - 1) // EMBED_BATCH_SIZE + 1
+    if progress:
+        progress(batches_total=total_batches)
+
+    def upsert_batch(records):
+        upsert_vectors(index, records)
+        if progress:
+            progress(batch_done=1, chunks_done=len(records))
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as uploader:
+        for batch_num, start in enumerate(range(0, len(chunks), EMBED_BATCH_SIZE), 1):
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            vectors = embed_documents_cached([chunk["text"] for chunk in batch])
+            # The text is stored under "text" so the vectorstore can return page_content
+            records = [
+                (chunk["id"], vector, dict(chunk["metadata"], text=chunk["text"]))
+                for chunk, vector in zip(batch, vectors)
+            ]
+            if pending is not None:
+                pending.result()
+            pending = uploader.submit(upsert_batch, records)
+            logging.info(f"✅ Embedded batch {batch_num}/{total_batches} ({len(batch)} chunks), upserting in background")
+        if pending is not None:
+            pending.result()
+
+def populate_pinecone_index(full_rebuild=False, scan=None, progress=None):
+    """Sync the Pinecone index with the PDF documents in the policies folder.
+
+    Vector IDs are derived from source, page, type and content, so upserts are
+    idempotent. Only chunks from new or changed pages are embedded, and
+    vectors for changed, removed or deleted pages are deleted by ID. When
+    there is no usable manifest (or full_rebuild=True) every chunk is
+    upserted and any vector ID not in the current corpus is pruned. Pass the
+    result of scan_policy_documents() as scan to reuse an extraction already
+    done. progress is forwarded to the scan and to embed_and_upsert().
+    """
+    try:
+        if scan is None:
+            scan = scan_policy_documents(POLICIES_FOLDER, full_rebuild=full_rebuild, progress=progress)
     except Exception as e:
         logging.error(f"❌ Error in document processing: {str(e)}")
         raise
 
+    summary = dict(scan["summary"], deleted_vectors=0, upserted_vectors=0)
+    new_chunks = scan["new_chunks"]
+    stale_ids = scan["stale_ids"]
+
     try:
-        all_chunks = documents + table_chunks
-        total_chunks = len(texts)
-        
-        if total_chunks == 0:
-            raise ValueError("No content extracted from documents")
-        
-        logging.info(f"📊 Preparing to insert {total_chunks} chunks into Pinecone")
-        
         # Initialize Pinecone components
         pc = Pinecone(api_key=PINECONE_API_KEY)
         index = pc.Index(PINECONE_INDEX_NAME)
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        
-        # Insert in batches
-        batch_size = 50  # Reduced batch size for better reliability
-        for i in range(0, total_chunks, batch_size):
-            batch_texts = texts[i:i + batch_size]
-            batch_metas = metadatas[i:i + batch_size]
-            PineconeVectorStore.from_texts(
-                texts=batch_texts,
-                embedding=embeddings,
-                index_name=PINECONE_INDEX_NAME,
-                metadatas=batch_metas
-            )
-            logging.info(f"✅ Inserted batch {i//batch_size + 1}/{(total_chunks-1)//batch_size + 1}")
-        
-        # Verify insertion
+
+        if stale_ids:
+            delete_vectors(index, stale_ids)
+            summary["deleted_vectors"] = len(stale_ids)
+            logging.info(f"🗑️ Deleted {len(stale_ids)} vectors for changed or removed pages")
+
+        total_chunks = len(new_chunks)
+        if progress:
+            progress(chunks_total=total_chunks)
+        if total_chunks:
+            logging.info(f"📊 Preparing to insert {total_chunks} chunks into Pinecone")
+            embed_and_upsert(index, new_chunks, progress)
+            summary["upserted_vectors"] = total_chunks
+
+        live_chunks = policy_chunks(scan["files"])
+        if scan["full_rebuild"]:
+            live_ids = {chunk["id"] for chunk in live_chunks}
+            summary["deleted_vectors"] += prune_stale_vectors(index, live_ids)
+        evict_embedding_cache(chunk["text"] for chunk in live_chunks)
+
+        # Only record the new state once Pinecone reflects it
+        save_index_manifest({"files": scan["files"]})
+
         stats = index.describe_index_stats()
         vector_count = stats['total_vector_count']
-        logging.info(f"🎉 Successfully populated index with {vector_count} vectors")
-        
+        logging.info(
+            f"🎉 Index sync complete: {summary['changed_files']} changed, {summary['unchanged_files']} unchanged, "
+            f"{summary['deleted_files']} deleted files; {summary['reindexed_pages']} pages re-embedded; "
+            f"{vector_count} vectors in index"
+        )
+        return summary
+
     except Exception as e:
         logging.error(f"❌ Error in Pinecone operations: {str(e)}")
         raise
@@ -2532,7 +3043,7 @@ def initialize_pinecone():
                 return True
             else:
                 logging.info(f"⚠️ Index '{index_name}' exists but is empty - populating...")
-                populate_pinecone_index()
+                populate_pinecone_index(full_rebuild=True)
                 return True
         else:
             # Create new index only if it doesn't exist
@@ -2550,7 +3061,7 @@ def initialize_pinecone():
             
             # Populate the new index
             logging.info("📚 Populating new Pinecone index...")
-            populate_pinecone_index()
+            populate_pinecone_index(full_rebuild=True)
             
             return True
         
@@ -2558,76 +3069,1476 @@ def initialize_pinecone():
         logging.error(f"❌ Error initializing Pinecone: {str(e)}")
         return False
 
+def sync_local_vector_index(scan, progress=None):
+    """Local-backend counterpart of populate_pinecone_index().
+
+    Rebuilds the local matrix from every live chunk whenever the policy
+    files change; unchanged chunks come straight from the embedding cache,
+    so only new text reaches the model.
+    """
+    summary = dict(scan["summary"], vectors=0)
+    chunks = policy_chunks(scan["files"])
+    version = policy_fingerprint({filename: entry["sha256"] for filename, entry in scan["files"].items()})
+
+    if local_vector_store.version == version and not scan["full_rebuild"]:
+        logging.info("✅ Local vector index already matches the policy documents")
+    elif chunks:
+        total_batches = (len(chunks) - 1) // EMBED_BATCH_SIZE + 1
+        if progress:
+            progress(chunks_total=len(chunks), batches_total=total_batches)
+        vectors = []
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            vectors.extend(embed_documents_cached([chunk["text"] for chunk in batch]))
+            if progress:
+                progress(batch_done=1, chunks_done=len(batch))
+        local_vector_store.publish(vectors, chunks, version)
+        logging.info(f"🎉 Local vector index rebuilt with {len(chunks)} vectors")
+    else:
+        logging.warning("⚠️ No content found for the local vector index")
+
+    evict_embedding_cache(chunk["text"] for chunk in chunks)
+    save_index_manifest({"files": scan["files"]})
+    summary["vectors"] = len(chunks)
+    return summary
+
+def sync_vector_index(scan=None, full_rebuild=False, progress=None):
+    """Bring the configured vector backend (VECTOR_BACKEND) in line with HR_docs."""
+    if VECTOR_BACKEND == "local":
+        if scan is None:
+            scan = scan_policy_documents(POLICIES_FOLDER, full_rebuild=full_rebuild, progress=progress)
+        return sync_local_vector_index(scan, progress)
+    return populate_pinecone_index(full_rebuild=full_rebuild, scan=scan, progress=progress)
+
+def initialize_vector_store():
+    """Startup entry point for whichever vector backend is configured."""
+    if VECTOR_BACKEND != "local":
+        return initialize_pinecone()
+    try:
+        logging.info("🔧 Initializing local vector index...")
+        if local_vector_store.load() and local_vector_store.version == folder_fingerprint(POLICIES_FOLDER):
+            return True
+        sync_vector_index()
+        return True
+    except Exception as e:
+        logging.error(f"❌ Error initializing local vector index: {str(e)}")
+        return False
+
 # --- BM25 Setup ---
-bm25_index = None
-bm25_corpus = None
-bm25_metadata = []  # Store metadata for each BM25 chunk (filename, page, type)
+# One normaliser for indexing and querying: lowercase, keep word/number runs
+# (so markdown pipes and punctuation drop out), optionally Porter-stem
+BM25_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+bm25_stemmer = PorterStemmer()
+
+@lru_cache(maxsize=100000)
+def stem_token(token):
+    return bm25_stemmer.stem(token)
+
+def bm25_tokenize(text):
+    """Normalise text into BM25 terms. Used for chunks and questions alike."""
+    tokens = BM25_TOKEN_PATTERN.findall(text.lower())
+    if BM25_STEMMING:
+        return [stem_token(token) for token in tokens]
+    return tokens
+
+class InvertedBM25:
+    """BM25Okapi scoring over postings lists.
+
+    Scores match rank_bm25.BM25Okapi (same k1, b and epsilon idf floor).
+    Terms are interned as integer IDs and the postings live in CSR form:
+    postings for term t are doc_ids/weights[indptr[t]:indptr[t + 1]], with
+    idf and length normalisation folded into each weight. A query only
+    touches the postings of its terms.
+    """
 
-def build_bm25_index(folder_path):
-    """Builds BM25 index from policy documents with metadata tracking."""
-    global bm25_index, bm25_corpus, bm25_metadata
-    
-    all_texts = []
-    table_chunks = []
-    text_metadata = []  # Track metadata for text chunks
-    table_metadata = []  # Track metadata for table chunks
+    def __init__(self, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(corpus)
+        self.vocabulary = {}  # term -> term id, in first-seen order like BM25Okapi
+
+        # One (term id, doc id, tf) triple per distinct term in each document
+        term_ids, doc_ids, freqs = array('i'), array('i'), array('i')
+        doc_len = array('i')
+        for doc_id, document in enumerate(corpus):
+            doc_len.append(len(document))
+            for term, freq in Counter(document).items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(doc_id)
+                freqs.append(freq)
+        term_ids = np.frombuffer(term_ids, dtype=np.int32)
+        doc_len = np.frombuffer(doc_len, dtype=np.int32)
+        self.avgdl = int(doc_len.sum()) / self.corpus_size
+
+        # Same idf and epsilon floor as BM25Okapi._calc_idf
+        doc_freq = np.bincount(term_ids, minlength=len(self.vocabulary))
+        idf = [math.log(self.corpus_size - df + 0.5) - math.log(df + 0.5) for df in doc_freq.tolist()]
+        self.average_idf = sum(idf) / len(idf) if idf else 0.0
+        eps = self.epsilon * self.average_idf
+        self.idf = np.array([value if value >= 0 else eps for value in idf])
+
+        # Group postings by term; the stable sort keeps doc ids ascending within a term
+        order = np.argsort(term_ids, kind='stable')
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=self.indptr[1:])
+        self.doc_ids = np.frombuffer(doc_ids, dtype=np.int32)[order]
+        tf = np.frombuffer(freqs, dtype=np.int32)[order]
+        norm = k1 * (1 - b + b * doc_len / self.avgdl)
+        self.weights = self.idf[term_ids[order]] * (tf * (k1 + 1) / (tf + norm[self.doc_ids]))
+
+    def postings(self, term):
+        """(doc_ids, weights) views for term, or None if it is not in the corpus."""
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return None
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def get_scores(self, query):
+        """Dense score array over the whole corpus, as BM25Okapi.get_scores()."""
+        scores = np.zeros(self.corpus_size)
+        for term in query:
+            posting = self.postings(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def top_k(self, query, k, doc_mask=None):
+        """Return up to k (doc_id, score) pairs for documents matching the query.
+
+        Results are ordered by score descending, ties by doc_id, the same order
+        a stable descending sort of get_scores() gives. Documents containing
+        none of the query terms are never returned. doc_mask, a boolean array
+        over doc ids, restricts the search to a subset of the corpus; scores
+        (idf included) stay those of the whole corpus.
+        """
+        matched = [posting for posting in map(self.postings, query) if posting is not None]
+        if not matched or k <= 0:
+            return []
+        doc_ids = np.concatenate([posting[0] for posting in matched])
+        weights = np.concatenate([posting[1] for posting in matched])
+        if doc_mask is not None:
+            allowed = doc_mask[doc_ids]
+            doc_ids, weights = doc_ids[allowed], weights[allowed]
+            if doc_ids.size == 0:
+                return []
+        # bincount adds weights in query-term order, so sums match get_scores() exactly
+        candidates, slots = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(slots, weights=weights)
+
+        if len(candidates) > k:
+            # Keep everything tied with the k-th best score, then order exactly
+            kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+            keep = scores >= kth_score
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((candidates, -scores))[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+    def get_top_n(self, query, documents, n=5):
+        """BM25Okapi.get_top_n() equivalent; only matching documents are returned."""
+        return [documents[doc_id] for doc_id, _ in self.top_k(query, n)]
+
+@dataclass(frozen=True)
+class BM25Snapshot:
+    """One consistent, read-only generation of the BM25 index.
+
+    documents holds one prebuilt LangchainDocument per chunk (original text
+    and metadata), indexed like the BM25 doc ids. Hits hand out these shared
+    objects, so callers must not modify them. version is the fingerprint of
+    the policy files the snapshot was built from.
+    """
+    index: InvertedBM25
+    documents: tuple
+    version: str
+
+    @cached_property
+    def facets(self):
+        return metadata_facets(self.documents)
+
+    @cached_property
+    def sources(self):
+        """Every policy file in the snapshot."""
+        return frozenset(value for field, value in self.facets if field == "source")
+
+def chunk_documents(chunks):
+    """Build the snapshot's document store from chunk records."""
+    return tuple(LangchainDocument(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in chunks)
+
+FILTER_FIELDS = ("source", "type")  # Chunk metadata that retrieval can be filtered on
+
+def metadata_facets(documents):
+    """{(field, value): doc ids} for the filterable metadata of each document."""
+    facets = {}
+    for doc_id, doc in enumerate(documents):
+        for field in FILTER_FIELDS:
+            facets.setdefault((field, doc.metadata.get(field)), []).append(doc_id)
+    return {key: np.array(doc_ids, dtype=np.int64) for key, doc_ids in facets.items()}
+
+def metadata_filter_mask(facets, size, metadata_filter):
+    """Boolean mask over doc ids for a Pinecone-style metadata filter.
+
+    Supports {field: value}, {field: {"$eq": value}} and {field: {"$in": [values]}}
+    on FILTER_FIELDS, combined with AND - what route_question() produces.
+    """
+    mask = np.ones(size, dtype=bool)
+    for field, condition in metadata_filter.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unsupported filter field: {field}")
+        if isinstance(condition, dict):
+            values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+        else:
+            values = [condition]
+        field_mask = np.zeros(size, dtype=bool)
+        for value in values:
+            doc_ids = facets.get((field, value))
+            if doc_ids is not None:
+                field_mask[doc_ids] = True
+        mask &= field_mask
+    return mask
+
+# Replaced wholesale by build_bm25_index(); readers take one reference per query
+bm25_snapshot = None
+
+def policy_fingerprint(file_hashes):
+    """Fingerprint a document set from its {filename: sha256} mapping.
+
+    The chunk and index format versions are folded in, so bumping either one
+    changes the fingerprint and indexes built by older code are not reused.
+    """
+    payload = json.dumps([INDEX_MANIFEST_VERSION, BM25_CACHE_VERSION, sorted(file_hashes.items())])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def folder_fingerprint(folder_path):
+    """Fingerprint the PDFs currently in folder_path."""
+    if not os.path.exists(folder_path):
+        return policy_fingerprint({})
+    return policy_fingerprint({
+        filename: file_sha256(os.path.join(folder_path, filename))
+        for filename in os.listdir(folder_path) if filename.endswith('.pdf')
+    })
+
+def load_bm25_cache(fingerprint):
+    """Return the cached BM25 state for fingerprint, or None if missing or stale."""
+    try:
+        with open(BM25_CACHE_PATH, 'rb') as f:
+            cached = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"⚠️ Could not read BM25 cache, rebuilding: {e}")
+        return None
+    if (cached.get("version") != BM25_CACHE_VERSION or cached.get("fingerprint") != fingerprint
+            or cached.get("stemming") != BM25_STEMMING):
+        logging.info("♻️ BM25 cache is stale - rebuilding")
+        return None
+    return cached
+
+def save_bm25_cache(fingerprint, chunks, index):
+    """Atomically persist chunks and the BM25 index."""
+    try:
+        os.makedirs(INDEX_CACHE_FOLDER, exist_ok=True)
+        tmp_path = BM25_CACHE_PATH + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                "version": BM25_CACHE_VERSION,
+                "fingerprint": fingerprint,
+                "stemming": BM25_STEMMING,
+                "chunks": chunks,
+                "index": index
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, BM25_CACHE_PATH)
+    except Exception as e:
+        logging.warning(f"⚠️ Could not write BM25 cache: {e}")
+
+def build_bm25_index(folder_path, scan=None):
+    """Builds BM25 index from policy documents with metadata tracking.
+
+    scan is the result of scan_policy_documents(); when omitted the index is
+    loaded from the on-disk BM25 cache if it matches the current documents,
+    otherwise the folder is scanned (reusing manifest chunks for unchanged
+    files) and the cache is refreshed. The new BM25Snapshot is built off to
+    the side and published with a single assignment, so queries in flight
+    keep using the previous one. The policy table store is brought up to
+    date with the same chunks first.
+    """
+    global bm25_snapshot
+
+    if scan is None:
+        fingerprint = folder_fingerprint(folder_path)
+        cached = load_bm25_cache(fingerprint)
+        if cached:
+            chunks = cached["chunks"]
+            sync_policy_tables(chunks, fingerprint)
+            bm25_snapshot = BM25Snapshot(
+                index=cached["index"],
+                documents=chunk_documents(chunks),
+                version=fingerprint
+            )
+            logging.info(f"✅ BM25 index loaded from cache with {len(chunks)} document chunks")
+            return
+        scan = scan_policy_documents(folder_path)
+
+    fingerprint = policy_fingerprint({filename: entry["sha256"] for filename, entry in scan["files"].items()})
+    current = bm25_snapshot
+    if current is not None and current.version == fingerprint and not scan["full_rebuild"]:
+        logging.info("✅ BM25 index already matches the policy documents")
+        return
+
+    chunks = policy_chunks(scan["files"])
+    if chunks:
+        index = InvertedBM25([bm25_tokenize(chunk["text"]) for chunk in chunks])
+        # The table store is current before the new snapshot version is visible
+        sync_policy_tables(chunks, fingerprint)
+        bm25_snapshot = BM25Snapshot(
+            index=index,
+            documents=chunk_documents(chunks),
+            version=fingerprint
+        )
+        logging.info(f"✅ BM25 index built with {len(chunks)} document chunks (with metadata tracking)")
+        save_bm25_cache(fingerprint, chunks, index)
+    else:
+        logging.warning("⚠️ No content found for BM25 indexing")
+
+# --- Background Reindex Jobs ---
+REINDEX_JOB_HISTORY = 20  # finished jobs kept for status polling
+reindex_jobs = {}
+reindex_jobs_lock = threading.Lock()
+active_reindex_job_id = None
+queued_reindex_job_id = None  # full rebuild requested while an incremental job was running
+
+def new_reindex_job(full_rebuild):
+    return {
+        "job_id": uuid.uuid4().hex,
+        "status": "queued",
+        "phase": "queued",
+        "full_rebuild": full_rebuild,
+        "progress": {
+            "files_total": 0, "files_done": 0,
+            "chunks_total": 0, "chunks_done": 0,
+            "batches_total": 0, "batches_done": 0
+        },
+        "summary": None,
+        "error": None,
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "duration_seconds": None,
+        "_started": None
+    }
+
+def update_reindex_job(job, **fields):
+    with reindex_jobs_lock:
+        job.update(fields)
+
+def reindex_progress_callback(job):
+    """Build the progress callback passed down into the scan and upsert stages."""
+    def progress(files_total=None, file_done=None, chunks_total=None,
+                 batches_total=None, batch_done=0, chunks_done=0):
+        with reindex_jobs_lock:
+            counters = job["progress"]
+            if files_total is not None:
+                counters["files_total"] = files_total
+            if file_done is not None:
+                counters["files_done"] += 1
+            if chunks_total is not None:
+                counters["chunks_total"] = chunks_total
+            if batches_total is not None:
+                counters["batches_total"] = batches_total
+            counters["batches_done"] += batch_done
+            counters["chunks_done"] += chunks_done
+    return progress
+
+def run_reindex_job(job):
+    """Worker thread body: scan, sync Pinecone, rebuild BM25, record the outcome."""
+    global active_reindex_job_id, queued_reindex_job_id
+    started = time.perf_counter()
+    update_reindex_job(job, status="running", phase="scanning",
+                       started_at=datetime.now().isoformat(), _started=started)
+    progress = reindex_progress_callback(job)
+    try:
+        # Extract once; both indexes consume the same chunk list
+        scan = scan_policy_documents(POLICIES_FOLDER, full_rebuild=job["full_rebuild"], progress=progress)
+
+        # Sync the vector backend (only new or changed pages are embedded)
+        update_reindex_job(job, phase="embedding")
+        summary = sync_vector_index(scan=scan, progress=progress)
+
+        # Rebuild BM25 index
+        update_reindex_job(job, phase="bm25")
+        build_bm25_index(POLICIES_FOLDER, scan=scan)
+
+        update_reindex_job(job, status="completed", phase="done", summary=summary)
+        logging.info(f"✅ Reindex job {job['job_id']} completed in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logging.error(f"❌ Reindex job {job['job_id']} failed in phase {job['phase']}: {e}", exc_info=True)
+        update_reindex_job(job, status="failed", error=f"{job['phase']}: {e}")
+    finally:
+        # Cached answers and contexts may cite pages that changed, even if the job failed part way
+        answer_cache.clear()
+        retrieval_cache.clear()
+        with reindex_jobs_lock:
+            job["finished_at"] = datetime.now().isoformat()
+            job["duration_seconds"] = round(time.perf_counter() - started, 2)
+            next_job = reindex_jobs.get(queued_reindex_job_id)
+            active_reindex_job_id = queued_reindex_job_id
+            queued_reindex_job_id = None
+        if next_job is not None:
+            launch_reindex_job(next_job)
+
+def launch_reindex_job(job):
+    threading.Thread(target=run_reindex_job, args=(job,), name=f"reindex-{job['job_id'][:8]}", daemon=True).start()
+    logging.info(f"🔄 Started reindex job {job['job_id']} (full_rebuild={job['full_rebuild']})")
+
+def start_reindex_job(full_rebuild=False):
+    """Start a background reindex, or join the one already running.
+
+    Returns (job_id, outcome), outcome being "started", "joined" or "queued".
+    Only one reindex runs per process; a request arriving while one is running
+    gets that job's ID instead of starting a second pass over the same files.
+    A full rebuild requested during an incremental job is queued to run right
+    after it (once - later full rebuild requests join the queued job).
+    """
+    global active_reindex_job_id, queued_reindex_job_id
+    with reindex_jobs_lock:
+        if queued_reindex_job_id is not None and full_rebuild:
+            return queued_reindex_job_id, "joined"
+        if active_reindex_job_id is not None and (not full_rebuild or reindex_jobs[active_reindex_job_id]["full_rebuild"]):
+            return active_reindex_job_id, "joined"
+
+        job = new_reindex_job(full_rebuild)
+        reindex_jobs[job["job_id"]] = job
+        running_job_id = active_reindex_job_id
+        if running_job_id is not None:
+            queued_reindex_job_id = job["job_id"]
+        else:
+            active_reindex_job_id = job["job_id"]
+
+        # Forget the oldest finished jobs (dicts keep insertion order)
+        finished = [job_id for job_id, entry in reindex_jobs.items() if entry["finished_at"]]
+        for job_id in finished[:max(0, len(finished) - REINDEX_JOB_HISTORY)]:
+            del reindex_jobs[job_id]
+
+    if running_job_id is not None:
+        # run_reindex_job starts it when the running job finishes
+        logging.info(f"⏳ Queued full rebuild {job['job_id']} after reindex job {running_job_id}")
+        return job["job_id"], "queued"
+    launch_reindex_job(job)
+    return job["job_id"], "started"
+
+def get_reindex_job(job_id):
+    """Snapshot of a job for the status endpoint, or None if unknown."""
+    with reindex_jobs_lock:
+        job = reindex_jobs.get(job_id)
+        if job is None:
+            return None
+        status = {key: value for key, value in job.items() if not key.startswith("_")}
+        status["progress"] = dict(job["progress"])
+        if job["_started"] is not None and job["duration_seconds"] is None:
+            status["elapsed_seconds"] = round(time.perf_counter() - job["_started"], 2)
+        return status
+
+# --- Answer Cache ---
+class ExpiringLRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or approximate bytes.
+
+    Entries expire ttl seconds after being stored (ttl=None keeps them until
+    evicted). max_bytes needs sizeof(value) to estimate each entry's size.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (expires_at, value, size), least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                self.total_bytes -= self.entries.pop(key)[2]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_entries == 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[2]
+            self.entries[key] = (expires_at, value, size)
+            self.total_bytes += size
+            while ((self.max_entries is not None and len(self.entries) > self.max_entries)
+                   or (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                self.total_bytes -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def record_bypass(self):
+        with self.lock:
+            self.bypasses += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+answer_cache = ExpiringLRUCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+# Word characters plus any non-ASCII character, so Devanagari vowel signs and
+# other combining marks stay attached to their word instead of splitting it
+QUESTION_WORD_PATTERN = re.compile(r"(?:\w|[^\x00-\x7f\s])+")
+
+def normalize_question(text):
+    """Lowercase and reduce a question to its words, for use in cache keys."""
+    return " ".join(QUESTION_WORD_PATTERN.findall(text.lower()))
+
+def answer_cache_key(expanded_question, online_mode, index_version):
+    """index_version is the fingerprint of the BM25 snapshot the request captured."""
+    return (normalize_question(expanded_question), bool(online_mode), index_version)
+
+# --- Semantic Answer Cache ---
+# Present in every "not in the policy documents" reply (the RAG prompt's refusal
+# wording and OUT_OF_SCOPE_REPLY); such replies are never reused for paraphrases
+NO_ANSWER_MARKER = "is not available in our company policy documents"
+
+class SemanticAnswerCache:
+    """Past /api/ask policy answers reused for paraphrased questions.
+
+    Questions answered from the policy documents are recorded in qa_history
+    with the index version they were answered against. For the current
+    version their L2-normalised embeddings form one float32 matrix, so a
+    lookup is a single matrix-vector product. Answers rated below min_rating
+    in qa_feedback, directly or on a reply that reused them (qa_history rows
+    whose source_answer_id points at them), are left out; unrated ones are
+    kept. Refusals (NO_ANSWER_MARKER) are left out too, so one miss is not
+    repeated for every paraphrase. Answers older than ttl seconds are neither
+    loaded nor served. When the index version changes the matrix is rebuilt
+    in a background thread; lookups miss until it is ready.
+    """
+
+    def __init__(self, embeddings, max_entries, threshold, ttl, min_rating):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.min_rating = min_rating
+        # (version, matrix, entries) swapped as one tuple; entries[i] = (qa_history id, answer, created_at)
+        self.state = (None, np.zeros((0, 0), dtype=np.float32), [])
+        self.discarded = set()  # qa_history ids rated badly after they were loaded
+        self.loading_version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.last_load_seconds = None
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def embed_question(self, expanded_question):
+        # embed_query is memoised, so the vector search leg reuses this embedding
+        return self.normalize([self.embeddings.embed_query(expanded_question)])
+
+    def refresh(self, version):
+        """Rebuild the matrix for version in the background, unless already underway."""
+        with self.lock:
+            if self.max_entries == 0 or version is None or self.loading_version == version:
+                return
+            self.loading_version = version
+        threading.Thread(target=self.load, args=(version,), name="semantic-cache-load", daemon=True).start()
+
+    def load(self, version):
+        started = time.perf_counter()
+        try:
+            conn = sqlite3.connect(DATABASE_NAME)
+            try:
+                rows = conn.execute("""
+                    SELECT qh.id, qh.question, qh.final_answer, strftime('%s', qh.timestamp)
+                    FROM qa_history qh
+                    WHERE qh.index_version = ?
+                      AND qh.final_answer != ''
+                      AND instr(qh.final_answer, ?) = 0
+                      AND qh.timestamp >= datetime('now', ?)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM qa_history rated
+                          JOIN qa_feedback qf ON qf.question_id = rated.id
+                          WHERE (rated.id = qh.id OR rated.source_answer_id = qh.id)
+                            AND qf.rating < ?
+                      )
+                    ORDER BY qh.id DESC
+                    LIMIT ?
+                """, (version, NO_ANSWER_MARKER, f"-{self.ttl} seconds", self.min_rating,
+                      self.max_entries)).fetchall()
+            finally:
+                conn.close()
+
+            # Oldest first, so add() can drop from the front; repeats keep their latest answer
+            latest = {}
+            for row_id, question, answer, created_at in reversed(rows):
+                latest[preprocess_query(question).text] = (row_id, answer, float(created_at))
+            texts = list(latest)
+            if texts:
+                matrix = self.normalize(self.embeddings.embed_documents(texts))
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            with self.lock:
+                self.state = (version, matrix, list(latest.values()))
+                self.last_load_seconds = round(time.perf_counter() - started, 2)
+            logging.info(f"🧠 Semantic answer cache loaded {len(texts)} past answers "
+                         f"in {self.last_load_seconds}s")
+        except Exception as e:
+            logging.error(f"❌ Error loading semantic answer cache: {str(e)}")
+        finally:
+            with self.lock:
+                if self.loading_version == version:
+                    self.loading_version = None
+
+    def lookup(self, expanded_question, version):
+        """(qa_history id, answer) of the most similar past question at or above the threshold, else None."""
+        if self.max_entries == 0:
+            return None
+        loaded_version, matrix, entries = self.state
+        if loaded_version != version:
+            self.refresh(version)
+            entries = []
+        answer = similarity = source_id = None
+        if entries:
+            vector = self.embed_question(expanded_question)[0]
+            scores = matrix @ vector
+            expired_before = time.time() - self.ttl
+            for row in np.argsort(-scores):
+                if scores[row] < self.threshold:
+                    break
+                row_id, candidate, created_at = entries[row]
+                if created_at >= expired_before and row_id not in self.discarded:
+                    answer, similarity, source_id = candidate, float(scores[row]), row_id
+                    break
+        with self.lock:
+            if answer is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        logging.info(f"🧠 Semantic answer cache hit (similarity {similarity:.3f}, answer #{source_id}) for: {expanded_question[:80]}")
+        return source_id, answer
+
+    def add(self, row_id, expanded_question, answer, version):
+        """Make a freshly generated answer available to later paraphrases."""
+        if self.max_entries == 0 or NO_ANSWER_MARKER in answer:
+            return
+        vector = self.embed_question(expanded_question)
+        with self.lock:
+            loaded_version, matrix, entries = self.state
+            if loaded_version != version:
+                return
+            matrix = np.vstack([matrix, vector]) if entries else vector
+            entries = entries + [(row_id, answer, time.time())]
+            if len(entries) > self.max_entries:
+                matrix, entries = matrix[-self.max_entries:], entries[-self.max_entries:]
+            self.state = (version, matrix, entries)
+
+    def discard(self, row_id):
+        """Stop serving an answer, e.g. once it has been rated badly."""
+        with self.lock:
+            self.discarded.add(row_id)
+
+    def record_bypass(self):
+        with self.lock:
+            self.bypasses += 1
+
+    def stats(self):
+        with self.lock:
+            version, _, entries = self.state
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(entries),
+                "max_entries": self.max_entries,
+                "index_version": version,
+                "loading": self.loading_version is not None,
+                "last_load_seconds": self.last_load_seconds,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "min_rating": self.min_rating,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+semantic_answer_cache = SemanticAnswerCache(
+    query_embeddings,
+    max_entries=SEMANTIC_CACHE_SIZE,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    ttl=SEMANTIC_CACHE_TTL,
+    min_rating=SEMANTIC_CACHE_MIN_RATING
+)
+
+# --- Policy Retrieval ---
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+def pinecone_similarity_search(expanded_question, k, metadata_filter=None):
+    """similarity_search() against the Pinecone index with a client-side timeout.
+
+    The langchain wrappers do not pass request options through, so the query
+    is issued directly; a hung call then frees its retrieval thread after
+    PINECONE_QUERY_TIMEOUT instead of holding it indefinitely.
+    """
+    response = index.query(
+        vector=query_embeddings.embed_query(expanded_question),
+        top_k=k,
+        filter=metadata_filter,
+        include_metadata=True,
+        _request_timeout=PINECONE_QUERY_TIMEOUT
+    )
+    docs = []
+    for match in response.matches:
+        metadata = dict(match.metadata or {})
+        docs.append(LangchainDocument(page_content=metadata.pop("text", ""), metadata=metadata))
+    return docs
+
+def vector_search_leg(expanded_question, k, metadata_filter=None):
+    """Vector search (semantic similarity); the filter is applied by the backend."""
+    if vectorstore is None:
+        return []
+    if VECTOR_BACKEND == "local":
+        vector_docs = vectorstore.similarity_search(expanded_question, k=k, filter=metadata_filter)
+    else:
+        vector_docs = pinecone_similarity_search(expanded_question, k, metadata_filter)
+    logging.info(f"🔍 Vector search retrieved {len(vector_docs)} documents")
+    return vector_docs
+
+def bm25_search_leg(expanded_question, bm25, k, metadata_filter=None):
+    """BM25 search (keyword matching) - better for exact terms and tables."""
+    if bm25 is None:
+        return []
+    query_tokens = bm25_tokenize(expanded_question)
+    doc_mask = metadata_filter_mask(bm25.facets, len(bm25.documents), metadata_filter) if metadata_filter else None
+    # Prebuilt, shared documents: original formatting plus metadata; only relevant (score > 0) hits
+    bm25_results = [bm25.documents[idx] for idx, score in bm25.index.top_k(query_tokens, k, doc_mask) if score > 0]
+    logging.info(f"🔍 BM25 search retrieved {len(bm25_results)} documents")
+    return bm25_results
+
+# --- Document Router ---
+# Maps a question to the policies it names by matching its BM25 terms against
+# policy file titles, weighted by how few titles share each term. Acronyms are
+# already expanded ("posh" -> "policy on prevention of sexual harassment"), so
+# they route too. Questions that name no policy, or too many, are not filtered.
+# The route only narrows two of the three retrieval legs (see retrieve_policy_context).
+ROUTER_STOPWORDS = frozenset(bm25_tokenize("a an and the of on for to in with policy policies program agreement"))
+# Title words too common in questions to name a policy ("work from home" is not WORK PLACE ETHICS)
+ROUTER_GENERIC_TITLE_TERMS = frozenset(bm25_tokenize("work place employee code office non anti"))
+TABLE_QUESTION_PATTERN = re.compile(r"\b(?:table|tables|tabular|chart|matrix|grid)\b")
+
+@lru_cache(maxsize=4)
+def source_title_terms(sources):
+    """{term: idf} and {source: title terms} for a set of policy files."""
+    titles = {
+        source: frozenset(bm25_tokenize(os.path.splitext(source)[0])) - ROUTER_STOPWORDS - ROUTER_GENERIC_TITLE_TERMS
+        for source in sources
+    }
+    doc_freq = Counter(term for terms in titles.values() for term in terms)
+    idf = {term: math.log(len(titles) / freq) for term, freq in doc_freq.items()}
+    return idf, titles
+
+def named_policies(expanded_question, bm25):
+    """Policy files whose titles the question names, best matches only; [] if none."""
+    idf, titles = source_title_terms(bm25.sources)
+    terms = set(bm25_tokenize(expanded_question))
+    scores = {source: sum(idf[term] for term in title_terms & terms) for source, title_terms in titles.items()}
+    best = max(scores.values(), default=0)
+    if best < ROUTER_MIN_SCORE:
+        return []
+    # Keep policies scoring at least half the best match, e.g. "leave during probation" -> both
+    return sorted(source for source, score in scores.items() if score >= best / 2)
+
+def route_question(expanded_question, bm25):
+    """Pinecone-style metadata filter for the policies/chunk types a question targets, or None."""
+    if not DOCUMENT_ROUTING or bm25 is None:
+        return None
+    metadata_filter = {}
+
+    routed = named_policies(expanded_question, bm25)
+    if routed and len(routed) <= ROUTER_MAX_SOURCES:
+        metadata_filter["source"] = {"$in": routed}
+
+    if TABLE_QUESTION_PATTERN.search(expanded_question):
+        metadata_filter["type"] = {"$eq": "table"}
+
+    if metadata_filter:
+        logging.info(f"🧭 Routed retrieval to {metadata_filter}")
+    return metadata_filter or None
+
+# --- Policy Table Store ---
+# Every table extracted during ingestion, plus the static holiday tables, is kept
+# in SQLite with its column metadata and rows. Questions that clearly ask for a
+# table are answered with that table (or just its matching rows) and a citation,
+# skipping retrieval and Gemini entirely.
+POLICY_TABLE_SCHEMA = """
+    CREATE TABLE policy_tables (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        page INTEGER,
+        chunk_id TEXT,
+        title TEXT,
+        row_count INTEGER NOT NULL
+    );
+    CREATE TABLE policy_table_columns (
+        table_id INTEGER NOT NULL REFERENCES policy_tables (id),
+        position INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        is_numeric INTEGER NOT NULL,
+        PRIMARY KEY (table_id, position)
+    );
+    CREATE TABLE policy_table_rows (
+        table_id INTEGER NOT NULL REFERENCES policy_tables (id),
+        position INTEGER NOT NULL,
+        cells TEXT NOT NULL,
+        PRIMARY KEY (table_id, position)
+    );
+    CREATE TABLE policy_table_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+"""
+# Words that ask for a table; generic ones ("list", "entitlement") also fit prose answers, so are not cues
+POLICY_TABLE_CUE_PATTERN = re.compile(
+    r"\b(?:table|tables|tabular|chart|matrix|grid|scale|scales|band|bands|slab|slabs)\b")
+POLICY_TABLE_IGNORED_TERMS = ROUTER_STOPWORDS | frozenset(bm25_tokenize(
+    "table tables tabular chart matrix grid scale scales band bands slab slabs list entitlement entitlements "
+    "what which is are was do does can could i me my we our you your show give tell display get see find "
+    "all full complete about please per each there any who whom how when where why explain"
+))
+
+POLICY_TABLE_MAX_HEADER_WORDS = 8  # Longer header cells are prose caught in a table border, not column names
+POLICY_TABLE_MAX_CELL_WORDS = 20  # Tables averaging longer cells are boxed paragraphs, not lookups
+# Document control tables ("Amendment Date | Policy Version | Author | Approved By") on policy last pages
+POLICY_TABLE_HISTORY_PATTERN = re.compile(r"\b(?:amendment|version|revision|approved by|author)\b", re.IGNORECASE)
+
+def is_lookup_table(table):
+    """False for tables that only look like lookups: single columns, prose boxes, version history."""
+    if len(table["headers"]) < 2 or not table["rows"]:
+        return False
+    if any(POLICY_TABLE_HISTORY_PATTERN.search(name) for name in table["headers"]):
+        return False
+    cells = [cell for row in table["rows"] for cell in row if cell]
+    return sum(len(cell.split()) for cell in cells) <= POLICY_TABLE_MAX_CELL_WORDS * len(cells)
+
+def policy_table_records(chunks):
+    """Tables for the store: each ingested lookup table (rows with any content), then
+    the static holiday tables. Everything else stays RAG-only."""
+    records = []
+    for chunk in chunks:
+        if not chunk.get("table"):
+            continue
+        table = dict(chunk["table"], rows=[row for row in chunk["table"]["rows"] if any(row)])
+        if is_lookup_table(table):
+            records.append(dict(table, source=chunk["metadata"]["source"], page=chunk["metadata"]["page"],
+                                chunk_id=chunk["metadata"]["chunk_id"], title=None))
+    records.extend(dict(table, source=HOLIDAY_TABLE_SOURCE, page=None, chunk_id=None) for table in HOLIDAY_TABLES)
+    return records
+
+def column_is_numeric(cells):
+    """True when every non-empty cell is a number (the column tabulate would right-align)."""
+    types = {markdown_cell_type(cell) for cell in cells} - {None}
+    return bool(types) and types <= {int, float}
+
+def policy_table_store_version():
+    """Index version the table store was built from, or None if there is no usable store."""
+    if not os.path.exists(POLICY_TABLES_DB_PATH):
+        return None
+    try:
+        conn = sqlite3.connect(POLICY_TABLES_DB_PATH)
+        try:
+            row = conn.execute("SELECT value FROM policy_table_meta WHERE key = 'version'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+def sync_policy_tables(chunks, version):
+    """Rebuild the table store from chunk records unless it already holds version.
+
+    The new database is written next to the old one and swapped in with
+    os.replace, so lookups never see a half-built store.
+    """
+    if policy_table_store_version() == version:
+        return
+    try:
+        records = policy_table_records(chunks)
+        os.makedirs(INDEX_CACHE_FOLDER, exist_ok=True)
+        tmp_path = POLICY_TABLES_DB_PATH + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(POLICY_TABLE_SCHEMA)
+            for table_id, record in enumerate(records, 1):
+                conn.execute(
+                    "INSERT INTO policy_tables (id, source, page, chunk_id, title, row_count) VALUES (?, ?, ?, ?, ?, ?)",
+                    (table_id, record["source"], record["page"], record["chunk_id"], record["title"], len(record["rows"])))
+                conn.executemany(
+                    "INSERT INTO policy_table_columns (table_id, position, name, is_numeric) VALUES (?, ?, ?, ?)",
+                    [(table_id, position, name, column_is_numeric([row[position] for row in record["rows"]]))
+                     for position, name in enumerate(record["headers"])])
+                conn.executemany(
+                    "INSERT INTO policy_table_rows (table_id, position, cells) VALUES (?, ?, ?)",
+                    [(table_id, position, json.dumps(row, ensure_ascii=False)) for position, row in enumerate(record["rows"])])
+            conn.execute("INSERT INTO policy_table_meta (key, value) VALUES ('version', ?)", (version,))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, POLICY_TABLES_DB_PATH)
+        load_policy_table_catalog.cache_clear()
+        logging.info(f"✅ Policy table store built with {len(records)} tables")
+    except Exception as e:
+        # Table lookups just fall through to RAG until the next successful build
+        logging.warning(f"⚠️ Could not build the policy table store: {e}")
+
+@lru_cache(maxsize=2)
+def load_policy_table_catalog(version):
+    """Tables in the store (without rows) and the idf of their terms, or None.
+
+    A table's terms come from its title and column names only; its source
+    file name's terms are kept apart (source_terms), since every table of a
+    policy shares them. Cached per version; rows are read from SQLite on demand.
+    """
+    if policy_table_store_version() != version:
+        return None
+    conn = sqlite3.connect(POLICY_TABLES_DB_PATH)
+    try:
+        tables = {
+            table_id: {"id": table_id, "source": source, "page": page, "title": title, "headers": []}
+            for table_id, source, page, title in conn.execute("SELECT id, source, page, title FROM policy_tables")
+        }
+        for table_id, name in conn.execute("SELECT table_id, name FROM policy_table_columns ORDER BY table_id, position"):
+            tables[table_id]["headers"].append(name)
+    finally:
+        conn.close()
+    for table in tables.values():
+        # Placeholder names ("Column 2") and prose-length cells say nothing about the table
+        names = [name for name in table["headers"]
+                 if len(name.split()) <= POLICY_TABLE_MAX_HEADER_WORDS and not re.fullmatch(r"Column \d+", name)]
+        table["terms"] = frozenset(bm25_tokenize(" ".join([table["title"] or ""] + names))) - POLICY_TABLE_IGNORED_TERMS
+        table["source_terms"] = frozenset(bm25_tokenize(os.path.splitext(table["source"])[0])) - POLICY_TABLE_IGNORED_TERMS
+    doc_freq = Counter(term for table in tables.values() for term in table["terms"])
+    idf = {term: math.log(len(tables) / freq) + 1 for term, freq in doc_freq.items()}
+    return list(tables.values()), idf
+
+def policy_table_rows(table_ids):
+    """{table id: rows} read from the table store."""
+    conn = sqlite3.connect(POLICY_TABLES_DB_PATH)
+    try:
+        placeholders = ",".join("?" * len(table_ids))
+        rows = {table_id: [] for table_id in table_ids}
+        for table_id, cells in conn.execute(
+                f"SELECT table_id, cells FROM policy_table_rows WHERE table_id IN ({placeholders}) ORDER BY table_id, position",
+                list(table_ids)):
+            rows[table_id].append(json.loads(cells))
+        return rows
+    finally:
+        conn.close()
+
+def render_policy_table_answer(parts):
+    """Markdown for (table, rows) pairs: a heading, the rows as a table and a citation."""
+    sections = []
+    for table, rows in parts:
+        heading = table["title"] or os.path.splitext(table["source"])[0]
+        citation = f"[{table['source']}, page {table['page']}]" if table["page"] is not None else f"[{table['source']}]"
+        markdown = render_markdown_table(table["headers"], [list(column) for column in zip(*rows)])
+        sections.append(f"### {heading}\n\n{markdown}\n\n{citation}")
+    return "\n\n".join(sections)
+
+def answer_from_policy_tables(expanded_question, bm25, sources=None, require_cue=True,
+                              min_terms=POLICY_TABLE_MIN_TERMS, min_score=POLICY_TABLE_MIN_SCORE):
+    """Answer a question straight from the policy table store, or None to fall back to RAG.
+
+    Tables are scored on the idf-weighted overlap of the question's terms with
+    their title and column names; a table needs min_score from at least
+    min_terms distinct terms. Naming the policy only breaks ties. Among
+    the best tables, terms left over (e.g. "diwali" in "is diwali a holiday")
+    select the rows matching most of them. Otherwise the whole table is
+    returned, but only if one table (or one table continued across pages) is
+    left. require_cue demands a word such as "table" or "scale" in the
+    question; sources limits the tables searched.
+    """
+    if not POLICY_TABLE_ANSWERS or bm25 is None:
+        return None
+    if require_cue and not POLICY_TABLE_CUE_PATTERN.search(expanded_question):
+        return None
+    started = time.perf_counter()
+    try:
+        catalog = load_policy_table_catalog(bm25.version)
+    except sqlite3.Error as e:
+        logging.warning(f"⚠️ Policy table store unavailable: {e}")
+        return None
+    if not catalog:
+        return None
+    tables, idf = catalog
+
+    terms = set(bm25_tokenize(expanded_question)) - POLICY_TABLE_IGNORED_TERMS
+    scored = [(sum(idf[term] for term in matched), table)
+              for table in tables if sources is None or table["source"] in sources
+              for matched in [terms & table["terms"]] if len(matched) >= min_terms]
+    best_score = max((score for score, _ in scored), default=0)
+    if not scored or best_score < min_score:
+        return None
+    best = [table for score, table in scored if score == best_score]
+    # Ties go to tables from the policy the question names
+    best = [table for table in best if terms & table["source_terms"]] or best
+    rows_by_table = policy_table_rows([table["id"] for table in best])
+
+    # Specific rows: those containing the most leftover terms, across the best tables
+    leftover = terms - set().union(*(table["terms"] | table["source_terms"] for table in best))
+    row_matches = [
+        (len(leftover & set(bm25_tokenize(" ".join(row)))), table, row)
+        for table in best for row in rows_by_table[table["id"]]
+    ] if leftover else []
+    most = max((hits for hits, _, _ in row_matches), default=0)
+    if most:
+        parts = []
+        for table in best:
+            rows = [row for hits, match_table, row in row_matches if match_table is table and hits == most]
+            if rows:
+                parts.append((table, rows))
+    else:
+        if len({(table["source"], tuple(table["headers"])) for table in best}) > 1:
+            return None  # Several different tables match equally well - let RAG decide
+        parts = [(table, rows_by_table[table["id"]]) for table in best]
+
+    answer = render_policy_table_answer(parts)
+    matched = ", ".join(f"{table['source']} ({len(rows)} rows)" for table, rows in parts)
+    logging.info(f"📋 Answered from the policy table store in {(time.perf_counter() - started) * 1000:.1f} ms: {matched}")
+    return answer
+
+# --- Intent Router ---
+# Nearest-centroid classifier over the MiniLM question embeddings (the same
+# memoised vectors the semantic cache and vector search use). Each intent's
+# centroid is the mean of a handful of example questions; a question is sent
+# to the intent it is closest to, but only leaves the default RAG path when
+# the match is confident and the question does not name a policy. A question
+# is only called out of scope if BM25 also finds none of its terms in HR_docs.
+INTENT_EXAMPLES = {
+    # intent: (route, examples)
+    "thanks": ("static", [
+        "thanks", "thank you", "thank you so much", "thanks a lot", "that was helpful",
+        "great, thanks", "appreciate it", "thanks for the help",
+    ]),
+    "farewell": ("static", [
+        "bye", "goodbye", "see you later", "that's all for now", "talk to you later",
+        "good night", "have a nice day",
+    ]),
+    "small_talk": ("static", [
+        "how are you", "how is your day going", "what's up", "are you there",
+        "nice to meet you", "you are awesome", "okay cool", "are you a robot",
+    ]),
+    "table": ("table", [
+        "show me the grade structure", "what are the performance rating levels",
+        "which grade comes after PA5", "leave entitlement for each leave type",
+        "score and rating descriptions", "list of grades and designations",
+    ]),
+    "policy": ("rag", [
+        "how many casual leaves do I get in a year", "what is the notice period after resignation",
+        "can I work from home", "how do I apply for maternity leave", "what is the dress code",
+        "how do I raise a sexual harassment complaint", "what happens at the end of probation",
+        "how is the annual appraisal done", "when can I claim on duty", "can I carry forward unused leave",
+        "what is the employee referral bonus", "what are the office timings",
+        "can I accept gifts from a client", "what is the non compete clause",
+    ]),
+    "general": ("online", [
+        "what is the capital of france", "write a python function to sort a list",
+        "who won the football world cup", "explain quantum computing", "what is the weather today",
+        "tell me a joke", "translate this sentence to spanish", "what is the stock price of apple",
+        "recommend a good movie", "how do I cook pasta", "what is machine learning",
+    ]),
+}
+STATIC_REPLIES = {
+    "thanks": "You're welcome! Let me know if you have any other HR questions.",
+    "farewell": "Goodbye! Come back any time you have a question about our HR policies.",
+    "small_talk": f"I'm doing great, thanks for asking! I'm {BOT_INFO['name']}, your HR assistant - "
+                  f"ask me anything about our HR policies and benefits.",
+}
+OUT_OF_SCOPE_REPLY = (
+    "I'm sorry, but the information about '{question}' is not available in our company policy documents.\n\n"
+    "💡 **Suggestion**: Please enable the **'Go Online'** toggle and try asking your question again."
+)
+
+@dataclass(frozen=True)
+class IntentDecision:
+    intent: str        # nearest INTENT_EXAMPLES key, or "policy" when routing is off or unsure
+    route: str         # "static", "table", "rag" or "online"
+    similarity: float  # cosine to the chosen intent's centroid
+    reason: str        # why the route was chosen, for the logs
+
+class IntentRouter:
+    """Routes a question to a static reply, a table lookup, RAG or the online model.
+
+    Centroids are embedded on first use. record() counts every decision and
+    the answers given without a Gemini call, for /api/intent_router/stats.
+    """
+
+    def __init__(self, embeddings, examples):
+        self.embeddings = embeddings
+        self.examples = examples
+        self.intents = list(examples)
+        self.centroids = None
+        self.lock = threading.Lock()
+        self.decisions = Counter()
+        self.direct_answers = Counter()
+
+    def load_centroids(self):
+        with self.lock:
+            if self.centroids is None:
+                rows = []
+                for intent in self.intents:
+                    vectors = np.asarray(self.embeddings.embed_documents(
+                        [expand_acronyms(example) for example in self.examples[intent][1]]), dtype=np.float32)
+                    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                    centroid = vectors.mean(axis=0)
+                    rows.append(centroid / max(np.linalg.norm(centroid), 1e-12))
+                self.centroids = np.vstack(rows)
+                logging.info(f"🚦 Intent router ready with {len(self.intents)} intents")
+        return self.centroids
+
+    def classify(self, expanded_question, bm25):
+        if not INTENT_ROUTING:
+            return IntentDecision("policy", "rag", 0.0, "routing disabled")
+        centroids = self.load_centroids()
+        vector = np.asarray(self.embeddings.embed_query(expanded_question), dtype=np.float32)
+        scores = centroids @ (vector / max(np.linalg.norm(vector), 1e-12))
+        best = int(np.argmax(scores))
+        intent, similarity = self.intents[best], float(scores[best])
+        route = self.examples[intent][0]
+        if route == "rag":
+            return IntentDecision(intent, route, similarity, "nearest intent")
+        lead = similarity - float(scores[self.intents.index("policy")])
+        if similarity < INTENT_MIN_SIMILARITY or lead < INTENT_MIN_MARGIN:
+            return IntentDecision("policy", "rag", similarity, f"unsure ({intent} {similarity:.2f}, lead {lead:.2f})")
+        if route in ("static", "online") and bm25 is not None and named_policies(expanded_question, bm25):
+            return IntentDecision("policy", "rag", similarity, f"names a policy (not {intent})")
+        if route == "online" and (bm25 is None or policy_term_hits(expanded_question, bm25)):
+            return IntentDecision("policy", "rag", similarity, f"policy documents mention it (not {intent})")
+        return IntentDecision(intent, route, similarity, f"lead {lead:.2f} over policy")
+
+    def record(self, question, decision, answered_directly):
+        with self.lock:
+            self.decisions[decision.route] += 1
+            if answered_directly:
+                self.direct_answers[decision.route] += 1
+        outcome = "answered without Gemini" if answered_directly else "continuing"
+        logging.info(f"🚦 Intent route {decision.route} ({decision.intent}, {decision.similarity:.2f}, "
+                     f"{decision.reason}) - {outcome}: {question[:80]}")
+
+    def stats(self):
+        with self.lock:
+            total = sum(self.decisions.values())
+            saved = sum(self.direct_answers.values())
+            return {
+                "enabled": INTENT_ROUTING,
+                "decisions": dict(self.decisions),
+                "answered_without_llm": dict(self.direct_answers),
+                "llm_calls_saved": saved,
+                "llm_calls_saved_rate": round(saved / total, 3) if total else 0.0
+            }
+
+intent_router = IntentRouter(query_embeddings, INTENT_EXAMPLES)
+
+def policy_term_hits(expanded_question, bm25):
+    """True if BM25 finds any of the question's content words in the policy chunks.
+
+    Question words ("what", "show", ...) are dropped first: every chunk
+    scores above zero on them, so they would make any question look covered.
+    """
+    terms = [term for term in bm25_tokenize(expanded_question) if term not in POLICY_TABLE_IGNORED_TERMS]
+    return bool(terms) and any(score > 0 for _, score in bm25.index.top_k(terms, 1))
+
+def timed_leg(leg, *args):
+    started = time.perf_counter()
+    return leg(*args), time.perf_counter() - started
+
+def run_retrieval_legs(legs):
+    """Run retrieval legs concurrently, each bounded by RETRIEVAL_LEG_TIMEOUT.
+
+    legs maps a leg name to (function, args). Returns ({name: docs}, complete);
+    a leg that times out or fails contributes no documents and makes
+    complete False, so the answer still goes ahead with the other legs.
+    Vector legs go to retrieval_executor; BM25 legs are in-memory and run
+    inline while those are in flight, so a backlog of hung Pinecone calls in
+    the pool cannot hold them up.
+    """
+    deadline = time.perf_counter() + RETRIEVAL_LEG_TIMEOUT
+    futures = {name: retrieval_executor.submit(timed_leg, leg, *args)
+               for name, (leg, args) in legs.items() if leg is not bm25_search_leg}
+    inline = {}
+    for name, (leg, args) in legs.items():
+        if name not in futures:
+            try:
+                inline[name] = timed_leg(leg, *args)
+            except Exception as e:
+                inline[name] = e
+    done, _ = wait(futures.values(), timeout=max(0.0, deadline - time.perf_counter()))
+
+    results = {}
+    timings = []
+    complete = True
+    for name in legs:
+        results[name] = []
+        future = futures.get(name)
+        if future is None:
+            outcome = inline[name]
+        elif future not in done:
+            complete = False
+            timings.append(f"{name} timed out after {RETRIEVAL_LEG_TIMEOUT:g}s")
+            logging.warning(f"⚠️ {name} search timed out after {RETRIEVAL_LEG_TIMEOUT:g}s - continuing without it")
+            continue
+        else:
+            outcome = future.exception() or future.result()
+        if isinstance(outcome, BaseException):
+            complete = False
+            timings.append(f"{name} failed")
+            logging.warning(f"⚠️ {name} search failed: {outcome}")
+        else:
+            results[name], elapsed = outcome
+            timings.append(f"{name} {elapsed * 1000:.0f} ms")
+    logging.info(f"⏱️ Retrieval legs: {', '.join(timings)}")
+    return results, complete
+
+def retrieve_policy_context(expanded_question, bm25):
+    """Hybrid retrieval for /api/ask: vector + BM25 hits fused into one ranked context.
+
+    bm25 is the BM25Snapshot captured by the caller. Returns the assembled
+    context string, the source, page, retriever(s) and fused score of each
+    chunk in it, the number of table chunks, the metadata filter the document
+    router applied (None for the whole corpus) and whether every retrieval
+    leg answered in time.
+    """
+    # Step 1: Route targeted questions to their policies; filtered legs need fewer candidates
+    metadata_filter = route_question(expanded_question, bm25)
+    if metadata_filter:
+        vector_k, bm25_k = ROUTED_VECTOR_SEARCH_K, ROUTED_BM25_SEARCH_K
+    else:
+        vector_k, bm25_k = VECTOR_SEARCH_K, BM25_SEARCH_K
+
+    # Step 2: Hybrid retrieval - BM25 legs run while the vector leg is in flight. A routed question also
+    # gets an unfiltered BM25 leg, so the route boosts its policies (they rank in two more legs)
+    # without hiding relevant chunks elsewhere when the router guessed too narrowly
+    legs = {
+        'vector': (vector_search_leg, (expanded_question, vector_k, metadata_filter)),
+        'bm25': (bm25_search_leg, (expanded_question, bm25, bm25_k, metadata_filter))
+    }
+    if metadata_filter:
+        legs['bm25_corpus'] = (bm25_search_leg, (expanded_question, bm25, BM25_SEARCH_K))
+    leg_results, complete = run_retrieval_legs(legs)
     
-    # Process all PDF files with metadata
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".pdf"):
-            pdf_path = os.path.join(folder_path, filename)
-            
-            # Process PDF with metadata tracking
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    # Extract text
-                    text = page.extract_text() or ""
-                    if text:
-                        text_chunks = text_splitter.split_text(text)
-                        all_texts.extend(text_chunks)
-                        # Add metadata for each text chunk
-                        for chunk in text_chunks:
-                            text_metadata.append({
-                                "source": filename,
-                                "page": page_num,
-                                "type": "text"
-                            })
-                    
-                    # Extract tables
-                    tables = page.extract_tables()
-                    for table_num, table in enumerate(tables, 1):
-                        if table and len(table) > 1:
-                            df = pd.DataFrame(table[1:], columns=table[0])
-                            table_markdown = dataframe_to_clean_markdown(df)
-                            
-                            # Enrich table for better BM25 matching
-                            column_names = " ".join([str(col).lower() for col in df.columns if col])
-                            sample_values = []
-                            num_sample_cols = min(3, len(df.columns))
-                            for col_idx in range(num_sample_cols):
-                                series = df.iloc[:, col_idx]
-                                sample_values.extend([str(val).lower() for val in series.dropna().head(3).tolist()])
-                            sample_context = " ".join(sample_values[:10])
-                            enriched_table = f"[TABLE DATA] Topic: {column_names} {sample_context}\n\n{table_markdown}\n\n[END TABLE]"
-                            table_chunks.append(enriched_table)
-                            # Add metadata for table chunk
-                            table_metadata.append({
-                                "source": filename,
-                                "page": page_num,
-                                "type": "table"
-                            })
+    # Step 3: Fuse the leg rankings into one scored list
+    fused = fuse_ranked_results(leg_results)
+    if metadata_filter and not (leg_results['vector'] or leg_results['bm25']):
+        # The router guessed wrong (or the policy has no such chunks) - search everything
+        logging.info("🧭 Filtered retrieval found nothing - retrying over the whole corpus")
+        metadata_filter = None
+        leg_results, complete = run_retrieval_legs({
+            'vector': (vector_search_leg, (expanded_question, VECTOR_SEARCH_K)),
+            'bm25': (bm25_search_leg, (expanded_question, bm25, BM25_SEARCH_K))
+        })
+        fused = fuse_ranked_results(leg_results)
     
-    # Combine text and tables for indexing
-    all_chunks = all_texts + table_chunks
-    bm25_metadata = text_metadata + table_metadata
+    # Step 4: Pack the best chunks, with source citations (filename + page), into the token budget
+    blocks, packed, context_tokens = pack_context(fused[:CONTEXT_TOP_K], CONTEXT_TOKEN_BUDGET)
+    sources = []
+    for i, (hit, citation, truncated) in enumerate(packed):
+        doc = hit["doc"]
+        metadata = doc.metadata or {}
+        sources.append({"source": metadata.get('source', 'Unknown Document'), "page": metadata.get('page', 'N/A'),
+                        "retriever": "+".join(hit["retrievers"]), "score": round(hit["score"], 5)})
+        logging.info(f"   #{i + 1} {hit['score']:.4f} {'table' if hit['is_table'] else 'text '} "
+                     f"[{'+'.join(hit['retrievers'])}] {citation}{' (truncated)' if truncated else ''}")
+    table_count = sum(1 for hit, _, _ in packed if hit["is_table"])
     
-    if all_chunks:
-        # Tokenize for BM25
-        bm25_corpus = [text.split() for text in all_chunks]
-        bm25_index = BM25Okapi(bm25_corpus)
-        logging.info(f"✅ BM25 index built with {len(bm25_corpus)} document chunks (with metadata tracking)")
+    if packed:
+        context = CONTEXT_SEPARATOR.join(blocks)
+        
+        # Log retrieval stats
+        logging.info(f"📚 Total unique documents retrieved: {len(fused)}; packed {len(packed)} "
+                     f"({table_count} tables, {len(packed) - table_count} text) into ~{context_tokens}/{CONTEXT_TOKEN_BUDGET} tokens")
     else:
-        logging.warning("⚠️ No content found for BM25 indexing")
+        context = ""
+        logging.warning("⚠️ No documents retrieved from knowledge base")
+
+    return {
+        "context": context,
+        "sources": tuple(sources),
+        "tables": table_count,
+        "context_tokens": context_tokens,
+        "filter": metadata_filter,
+        "complete": complete
+    }
+
+def estimate_tokens(text):
+    """Rough Gemini token count for text (about CHARS_PER_TOKEN characters per token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"[.!?](?=\s)|\n")
+
+def chunk_citation(doc, position):
+    """Citation label for a context chunk: "file.pdf, page N", or "Source N" without metadata."""
+    # Extract actual source filename and page from metadata
+    source_name = doc.metadata.get('source', 'Unknown Document') if hasattr(doc, 'metadata') and doc.metadata else 'Unknown Document'
+    page_num = doc.metadata.get('page', 'N/A') if hasattr(doc, 'metadata') and doc.metadata else 'N/A'
+    if source_name == 'Unknown Document':
+        return f"Source {position}"
+    return f"{source_name}, page {page_num}" if page_num != 'N/A' else source_name
+
+def word_shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))} if words else set()
+
+def truncate_at_sentence(text, max_chars):
+    """Longest prefix of text within max_chars ending at a sentence or line break ('' if none)."""
+    cut = 0
+    for match in SENTENCE_BOUNDARY_PATTERN.finditer(text, 0, max(max_chars, 0)):
+        cut = match.end()
+    return text[:cut].rstrip()
+
+def pack_context(hits, budget_tokens):
+    """Greedily pack ranked hits into about budget_tokens of labelled context.
+
+    Hits are taken best first. A chunk whose word 5-grams are already
+    PACK_DUPLICATE_THRESHOLD covered by packed chunks of the same kind (a
+    near-duplicate, or a splitter overlap of one) is skipped; tables are
+    only compared with tables, since page text repeats their cells without
+    the markdown layout. The first chunk that does not fit
+    is cut at the last sentence or line boundary inside the budget and
+    packing stops there. Returns (blocks, packed, tokens) where packed lists
+    (hit, citation, truncated) per block.
+    """
+    blocks, packed = [], []
+    seen_shingles = {True: set(), False: set()}  # keyed by is_table
+    used = 0
+    for hit in hits:
+        doc = hit["doc"]
+        shingles = word_shingles(doc.page_content)
+        seen = seen_shingles[hit["is_table"]]
+        if shingles and len(shingles & seen) >= PACK_DUPLICATE_THRESHOLD * len(shingles):
+            logging.info(f"   ✂️ Skipping near-duplicate chunk from {chunk_citation(doc, len(packed) + 1)}")
+            continue
+
+        citation = chunk_citation(doc, len(packed) + 1)
+        # Add relevance indicator for tables with proper citation
+        if hit["is_table"]:
+            label = f"[RELEVANT TABLE DATA - {citation}]\n"
+        else:
+            label = f"[RELEVANT CONTEXT - {citation}]\n"
+        overhead = estimate_tokens(label) + (estimate_tokens(CONTEXT_SEPARATOR) if blocks else 0)
+        text, truncated = doc.page_content, False
+        if used + overhead + estimate_tokens(text) > budget_tokens:
+            remaining_tokens = budget_tokens - used - overhead
+            if remaining_tokens < PACK_MIN_TAIL_TOKENS and packed:
+                break
+            text = truncate_at_sentence(text, remaining_tokens * CHARS_PER_TOKEN)
+            if not text and not packed:
+                # Never send an empty context just because the best chunk has no boundary
+                text = doc.page_content[:max(remaining_tokens, 1) * CHARS_PER_TOKEN]
+            if not text:
+                break
+            truncated = True
+
+        blocks.append(label + text)
+        packed.append((hit, citation, truncated))
+        seen |= shingles
+        used += overhead + estimate_tokens(text)
+        if truncated:
+            break
+    return blocks, packed, used
+
+def stream_gemini_answer(prompt):
+    """Stream Gemini's answer to prompt, logging the prompt's token count."""
+    logging.info(f"🧮 Prompt ≈ {estimate_tokens(prompt)} tokens (estimated)")
+    response = model.generate_content(prompt, stream=True)
+    for chunk in response:
+        if chunk.text:
+            yield chunk.text
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        logging.info(f"🧮 Gemini usage: {usage.prompt_token_count} prompt tokens, "
+                     f"{usage.candidates_token_count} answer tokens")
+
+def is_table_chunk(doc):
+    return "[TABLE DATA]" in doc.page_content or ("|" in doc.page_content and doc.page_content.count("|") > 3)
+
+def fuse_ranked_results(leg_results):
+    """Reciprocal rank fusion of the per-leg rankings.
+
+    A chunk scores sum(1 / (RRF_K + rank)) over the legs that returned it
+    (rank starts at 1); table chunks are multiplied by FUSION_TABLE_BOOST.
+    Chunks are matched across legs by their first 100 characters. Returns
+    dicts with doc, score, retrievers and is_table, best first; ties keep
+    first-seen order.
+    """
+    fused = {}
+    for name, docs in leg_results.items():
+        for rank, doc in enumerate(docs, 1):
+            key = hash(doc.page_content[:100])
+            hit = fused.get(key)
+            if hit is None:
+                hit = fused[key] = {"doc": doc, "score": 0.0, "retrievers": [], "is_table": is_table_chunk(doc)}
+            elif name in hit["retrievers"]:
+                continue  # A leg's own duplicates count once, at their best rank
+            hit["score"] += 1.0 / (RRF_K + rank)
+            hit["retrievers"].append(name)
+    for hit in fused.values():
+        if hit["is_table"]:
+            hit["score"] *= FUSION_TABLE_BOOST
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)
+
+def retrieval_size(retrieval):
+    """Approximate bytes held by a cached retrieval result."""
+    return sys.getsizeof(retrieval["context"]) + sum(
+        sys.getsizeof(source) + sys.getsizeof(source["source"]) for source in retrieval["sources"])
+
+retrieval_cache = ExpiringLRUCache(max_bytes=RETRIEVAL_CACHE_MAX_BYTES, sizeof=retrieval_size)
+
+def retrieval_cache_key(expanded_question, bm25):
+    """Key retrieval on the question's BM25 terms, so near-repeats (case,
+    punctuation, plurals) share an entry, and on the snapshot version.
+
+    BM25 only sees ASCII words, so non-ASCII words (Hindi, accented names) are
+    kept verbatim; otherwise such questions would all share one key.
+    """
+    terms = bm25_tokenize(expanded_question)
+    terms += [word for word in normalize_question(expanded_question).split() if not word.isascii()]
+    return (" ".join(terms), bm25.version if bm25 is not None else None)
 
 def expand_query_with_llm(question, llm):
     """Expands user query using LLM to include synonyms but retains original meaning."""
@@ -2645,17 +4556,16 @@ def expand_query_with_llm(question, llm):
 
 def hybrid_search(question, llm, retriever):
     """Performs hybrid retrieval using BM25 and Pinecone vectors."""
-    global bm25_index, bm25_corpus
-    
     # Expand query
     expanded_query = expand_query_with_llm(question, llm)
     
     results = []
     
     # Step 1: BM25 Keyword Search
-    if bm25_index and bm25_corpus:
-        bm25_results = bm25_index.get_top_n(expanded_query.split(), bm25_corpus, n=5)
-        bm25_texts = [" ".join(text) for text in bm25_results]
+    bm25 = bm25_snapshot
+    if bm25 is not None:
+        bm25_results = bm25.index.get_top_n(bm25_tokenize(expanded_query), bm25.documents, n=5)
+        bm25_texts = [doc.page_content for doc in bm25_results]
         results.extend(bm25_texts)
         logging.info(f"🔍 BM25 Retrieved {len(bm25_texts)} results")
     
@@ -2740,13 +4650,6 @@ def setup_llm_chain():
     
     return llm, None, retriever  # Return llm, qa_chain (None for now), retriever
 
-def expand_acronyms(question):
-    """Expand HR-related acronyms in the question."""
-    expanded_question = question.lower()
-    for acronym, full_form in ACRONYM_MAP.items():
-        expanded_question = expanded_question.replace(acronym.lower(), full_form.lower())
-    return expanded_question
-
 async def analyze_career_progression(resume_text):
     """Analyze career progression from resume text using Gemini."""
     try:
@@ -4853,11 +6756,11 @@ if __name__ == "__main__":
     update_db_schema()
     
     try:
-        # Initialize Pinecone safely
-        vectorstore = initialize_pinecone()
+        # Initialize the vector backend (Pinecone or local) safely
+        initialize_vector_store()
         
         # Build BM25 index
-        logging.info("🔍 Building BM25 index...")
+        logging.info("🔍 Loading BM25 index (rebuilt only if HR_docs changed)...")
         build_bm25_index(POLICIES_FOLDER)
         
         # Set up LLM and QA chain
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+BM25 Benchmark
+Compares the postings-list BM25 engine used by /api/ask with rank_bm25.BM25Okapi
+on the HR_docs corpus: build time, per-query latency and score agreement.
+
+Usage: python benchmark_bm25.py [--repeat N] ["extra query" ...]
+Needs the same .env as the app, since it imports from app.py.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+from rank_bm25 import BM25Okapi
+from app import InvertedBM25, bm25_tokenize, scan_policy_documents, policy_chunks, POLICIES_FOLDER
+
+DEFAULT_QUERIES = [
+    "how many casual leaves do i get in a year",
+    "what is the notice period for resignation",
+    "holiday list 2025",
+    "on duty policy for client visits",
+    "maternity leave eligibility and duration",
+    "work from home approval process",
+    "reimbursement of travel expenses",
+    "what happens to unused earned leave at year end",
+    "probation period confirmation",
+    "sick leave medical certificate required",
+]
+
+def timed(fn, repeat):
+    """Best-of-repeat wall time in milliseconds, plus the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+def okapi_top_k(index, tokens, k):
+    """The selection /api/ask used before: score every chunk, sort all indices."""
+    scores = index.get_scores(tokens)
+    top = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+    return [(i, float(scores[i])) for i in top if scores[i] > 0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BM25 engines on HR_docs")
+    parser.add_argument("queries", nargs="*", help="extra queries to benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="timing repetitions per query")
+    parser.add_argument("-k", type=int, default=10, help="results per query")
+    args = parser.parse_args()
+
+    scan = scan_policy_documents(POLICIES_FOLDER)
+    # Both engines index the same normalised terms, so only the engines are compared
+    corpus = [bm25_tokenize(chunk["text"]) for chunk in policy_chunks(scan["files"])]
+    if not corpus:
+        print(f"❌ No chunks found in {POLICIES_FOLDER}")
+        return 1
+    print(f"📚 Corpus: {len(corpus)} chunks, {sum(len(doc) for doc in corpus)} tokens\n")
+
+    okapi_build, okapi = timed(lambda: BM25Okapi(corpus), 3)
+    inverted_build, inverted = timed(lambda: InvertedBM25(corpus), 3)
+    print(f"Build:  BM25Okapi {okapi_build:8.2f} ms   InvertedBM25 {inverted_build:8.2f} ms\n")
+
+    okapi_total = inverted_total = 0.0
+    mismatches = 0
+    print(f"{'query':<50} {'okapi ms':>9} {'inverted ms':>12} {'speedup':>8}")
+    for query in DEFAULT_QUERIES + args.queries:
+        tokens = bm25_tokenize(query)
+        okapi_ms, expected = timed(lambda: okapi_top_k(okapi, tokens, args.k), args.repeat)
+        inverted_ms, actual = timed(
+            lambda: [(i, s) for i, s in inverted.top_k(tokens, args.k) if s > 0], args.repeat)
+        okapi_total += okapi_ms
+        inverted_total += inverted_ms
+        if actual != expected or not np.allclose(okapi.get_scores(tokens), inverted.get_scores(tokens)):
+            mismatches += 1
+            print(f"⚠️  Results differ for: {query}")
+        print(f"{query[:50]:<50} {okapi_ms:9.3f} {inverted_ms:12.3f} {okapi_ms / max(inverted_ms, 1e-9):7.1f}x")
+
+    print(f"\nTotal:  BM25Okapi {okapi_total:.2f} ms   InvertedBM25 {inverted_total:.2f} ms "
+          f"({okapi_total / max(inverted_total, 1e-9):.1f}x)")
+    print("✅ Top-k results identical" if not mismatches else f"❌ {mismatches} queries differ")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
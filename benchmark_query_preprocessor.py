@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Query Preprocessor Benchmark
+Compares the compiled preprocessor used by /api/ask (one acronym regex plus hashed
+greeting/identity sets) with the chained str.replace / substring scans it replaced:
+per-question latency, and every question where the two disagree.
+
+Usage: python benchmark_query_preprocessor.py [--repeat N] ["extra question" ...]
+Needs the same .env as the app, since it imports from app.py.
+"""
+
+import sys
+import time
+import argparse
+from app import ACRONYM_MAP, GREETINGS, IDENTITY_QUESTIONS, preprocess_query
+
+DEFAULT_QUESTIONS = [
+    "hi",
+    "Good morning!",
+    "who are you?",
+    "what can you do",
+    "who uses the pto policy",
+    "how many casual leaves do i get in a year",
+    "is there a good wfh policy for new joiners",
+    "what is the od process for client visits",
+    "explain the appraisal and promotion cycle",
+    "office timings for the bangalore office",
+    "holiday list 2025",
+    "what is the notice period for resignation after probation confirmation",
+]
+
+def legacy_preprocess(question):
+    """The preprocessing /api/ask did before: chained replaces and ~100 substring scans."""
+    question_lower = question.lower().strip("?!. ")
+    if question_lower in GREETINGS:
+        intent = "greeting"
+    elif any(q in question_lower for q in IDENTITY_QUESTIONS):
+        intent = "identity"
+    elif "holiday" in question_lower or "holidays" in question_lower:
+        intent = "holiday"
+    else:
+        intent = "policy"
+    expanded_question = question.lower()
+    for acronym, full_form in ACRONYM_MAP.items():
+        expanded_question = expanded_question.replace(acronym.lower(), full_form.lower())
+    return expanded_question, intent
+
+def compiled_preprocess(question):
+    query = preprocess_query(question)
+    return query.text, query.intent
+
+def timed(fn, questions, repeat):
+    """Best-of-repeat wall time per question in microseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for question in questions:
+            fn(question)
+        best = min(best, time.perf_counter() - started)
+    return best * 1e6 / len(questions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /api/ask query preprocessing")
+    parser.add_argument("questions", nargs="*", help="extra questions to benchmark")
+    parser.add_argument("--repeat", type=int, default=2000, help="timing repetitions")
+    args = parser.parse_args()
+    questions = DEFAULT_QUESTIONS + args.questions
+
+    legacy_us = timed(legacy_preprocess, questions, args.repeat)
+    compiled_us = timed(compiled_preprocess, questions, args.repeat)
+    print(f"Per question:  legacy {legacy_us:8.2f} µs   compiled {compiled_us:8.2f} µs "
+          f"({legacy_us / max(compiled_us, 1e-9):.1f}x)\n")
+
+    # Differences are expected where the old substring matching misfired
+    # (e.g. "od" inside "good", "who u" inside "who uses"); they are listed for review
+    differences = 0
+    for question in questions:
+        legacy, compiled = legacy_preprocess(question), compiled_preprocess(question)
+        if legacy != compiled:
+            differences += 1
+            print(f"🔀 {question}")
+            print(f"   legacy:   [{legacy[1]}] {legacy[0]}")
+            print(f"   compiled: [{compiled[1]}] {compiled[0]}")
+    print(f"\n{differences} of {len(questions)} questions preprocess differently")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
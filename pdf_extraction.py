@@ -0,0 +1,272 @@
+"""
+PDF Extraction
+Turns policy PDFs into chunk records: page text split for retrieval, tables
+normalised and rendered as markdown, and a deterministic vector ID per chunk.
+
+Kept free of import-time side effects (no Pinecone, embedding model or
+database set-up) so app.py can run it in "spawn" worker processes during
+ingestion without each worker re-importing the whole app.
+"""
+
+import os
+import re
+import math
+import json
+import time
+import hashlib
+import pdfplumber
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Optimized chunking for HR policy documents:
+# - Larger chunks (1200) preserve context and complete policy explanations
+# - Higher overlap (250) ensures continuity across chunks
+# - Better separators prioritize paragraph/sentence boundaries
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=1200,        # Increased from 400 for better context retention
+    chunk_overlap=250,      # Increased from 50 (20% overlap for continuity)
+    separators=["\n\n", "\n", ". ", " ", ""]  # Better paragraph/sentence awareness
+)
+
+# Matches numbers written with thousands separators, e.g. "1,000" or "-12,500.75"
+NUMBER_WITH_THOUSANDS_PATTERN = re.compile(r"^(([+-]?[0-9]{1,3})(?:,([0-9]{3}))*)?(?(1)\.[0-9]*|\.[0-9]+)?$")
+TABLE_CELL_TYPE_RANK = {None: 0, bool: 1, int: 2, float: 3, str: 4}
+
+def is_int_cell(cell):
+    try:
+        int(cell)
+        return True
+    except ValueError:
+        return False
+
+def is_number_cell(cell):
+    try:
+        number = float(cell)
+    except ValueError:
+        return False
+    # Overflowing literals such as "1e999" are text; spelled-out inf/nan are numbers
+    return not (math.isinf(number) or math.isnan(number)) or cell.lower() in ("inf", "-inf", "nan")
+
+def markdown_cell_type(cell):
+    """Deduce a cell's type the way tabulate does when formatting and aligning columns."""
+    if cell == "":
+        return None  # Empty cells do not influence the column type
+    if cell in ("True", "False"):
+        return bool
+    if is_int_cell(cell) or (NUMBER_WITH_THOUSANDS_PATTERN.match(cell) and "." not in cell):
+        return int
+    if is_number_cell(cell) or NUMBER_WITH_THOUSANDS_PATTERN.match(cell):
+        return float
+    return str
+
+def markdown_decimal_places(cell):
+    """Digits after the decimal point (or exponent), -1 for integers and text."""
+    if not (is_number_cell(cell) or NUMBER_WITH_THOUSANDS_PATTERN.match(cell)) or is_int_cell(cell):
+        return -1
+    pos = cell.rfind(".")
+    pos = cell.lower().rfind("e") if pos < 0 else pos
+    return len(cell) - pos - 1 if pos >= 0 else -1
+
+def format_float_cell(cell):
+    try:
+        return format(float(cell.replace(",", "")), "g")
+    except ValueError:
+        return cell
+
+def render_markdown_table(headers, columns):
+    """Render string columns as a pipe table, byte-for-byte like tabulate's "pipe" format.
+
+    Text columns are left-aligned; numeric columns are formatted like
+    tabulate (floats with "g") and right-aligned on the decimal point.
+    """
+    if not headers:
+        return ""
+    multiline = any("\r" in header or "\n" in header for header in headers)
+    header_lines = [re.split(r"\r|\n|\r\n", header) if multiline else [header] for header in headers]
+    numeric = []
+    widths = []
+    unpadded_columns = []
+    padded_columns = []
+    for lines, cells in zip(header_lines, columns):
+        column_type = max((markdown_cell_type(cell) for cell in cells), key=TABLE_CELL_TYPE_RANK.get, default=bool)
+        is_numeric = column_type in (int, float)
+        if column_type is float:
+            cells = [format_float_cell(cell) if cell else "" for cell in cells]
+        if is_numeric:
+            decimals = [markdown_decimal_places(cell) for cell in cells]
+            max_decimals = max(decimals, default=-1)
+            cells = [cell + " " * (max_decimals - places) for cell, places in zip(cells, decimals)]
+        else:
+            cells = [cell.strip() for cell in cells]
+        unpadded_columns.append(cells)
+        width = max([len(cell) for cell in cells] + [max(len(line) for line in lines) + 2])
+        padded_columns.append([cell.rjust(width) if is_numeric else cell.ljust(width) for cell in cells])
+        numeric.append(is_numeric)
+        widths.append(width)
+
+    def row_line(cells):
+        return "| " + " | ".join(cells) + " |"
+
+    output = []
+    for line_num in range(max((len(lines) for lines in header_lines), default=1)):
+        output.append(row_line([
+            (lines[line_num].rjust(width) if is_numeric else lines[line_num].ljust(width)) if line_num < len(lines) else " " * width
+            for lines, width, is_numeric in zip(header_lines, widths, numeric)
+        ]))
+    output.append("|" + "|".join(
+        "-" * (width + 1) + ":" if is_numeric else ":" + "-" * (width + 1)
+        for width, is_numeric in zip(widths, numeric)
+    ) + "|")
+    for row_num in range(len(padded_columns[0]) if padded_columns else 0):
+        # Like tabulate, a multi-line layout renders rows with only empty cells as zero lines
+        if multiline and not any(cell_text[row_num] for cell_text in unpadded_columns):
+            continue
+        output.append(row_line([column[row_num] for column in padded_columns]))
+    return "\n".join(output)
+
+def clean_table(table):
+    """Normalise a pdfplumber table (list of rows, header first) into
+    (headers, columns) of strings.
+
+    - Fills missing/None headers with generic names (Column 1, Column 2, ...)
+    - Collapses multi-line cell content into single lines
+    - Ensures string-typed cells; missing (None) cells become empty strings
+    - Drops an index-like first column and columns that are entirely empty
+    """
+    header = list(table[0])
+    width = len(header)
+    # Pad or trim ragged rows to the header width
+    rows = [["" if cell is None else cell for cell in row[:width]] + [""] * (width - len(row)) for row in table[1:]]
+
+    # Normalize headers
+    headers = []
+    for i, col in enumerate(header):
+        col_str = str(col).strip() if col is not None else ""
+        if col_str == "" or col_str.lower() == "none":
+            col_str = f"Column {i+1}"
+        headers.append(col_str)
+    columns = [[row[i] for row in rows] for i in range(width)]
+
+    # Drop index-like first column if it looks like 0..N sequence
+    if columns:
+        try:
+            if [int(str(v)) for v in columns[0]] == list(range(len(rows))):
+                headers, columns = headers[1:], columns[1:]
+        except ValueError:
+            pass
+
+    # Drop columns that are entirely empty after stripping
+    non_empty_cols = [i for i, col in enumerate(columns) if any(str(v).strip() != "" for v in col)]
+    if non_empty_cols:
+        headers = [headers[i] for i in non_empty_cols]
+        columns = [columns[i] for i in non_empty_cols]
+
+    # Normalize cell content: string type, collapse newlines/tabs/whitespace runs, trim
+    columns = [[re.sub(r"\s+", " ", str(v)).strip() for v in col] for col in columns]
+
+    return headers, columns
+
+def table_to_clean_markdown(table):
+    """Convert a pdfplumber table (list of rows, header first) into a clean
+    GitHub-flavored markdown table without going through pandas (see clean_table)."""
+    return render_markdown_table(*clean_table(table))
+
+def table_topic(table):
+    """Topic line for a table chunk: column names plus a few sample values."""
+    # 1. Extract column names as descriptive keywords
+    column_names = " ".join([str(col).lower() for col in table[0] if col])
+
+    # 2. Extract sample data values (first 3 non-empty values of up to 3 columns) as context
+    sample_values = []
+    for col_idx in range(min(3, len(table[0]))):
+        values = [row[col_idx] for row in table[1:] if col_idx < len(row) and row[col_idx] is not None]
+        sample_values.extend([str(val).lower() for val in values[:3]])
+    sample_context = " ".join(sample_values[:10])
+    return f"{column_names} {sample_context}"
+
+def page_content_hash(text, tables):
+    """Hash a page's extracted text and raw tables."""
+    payload = json.dumps([text, tables], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def extract_pdf_pages(pdf_path):
+    """Yield (page_num, text, tables) for every page of a PDF."""
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num, page in enumerate(pdf.pages, 1):
+            yield page_num, page.extract_text() or "", page.extract_tables()
+
+def build_table_chunk(table):
+    """Render a pdfplumber table as an enriched markdown chunk for retrieval."""
+    return f"[TABLE DATA] Topic: {table_topic(table)}\n\n{table_to_clean_markdown(table)}\n\n[END TABLE]"
+
+def make_vector_id(source, page, chunk_type, text):
+    """Deterministic vector ID derived from source, page, chunk type and content.
+
+    The source is hashed so IDs stay ASCII and every vector of a document
+    shares the same prefix.
+    """
+    source_key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:24]
+    return f"{source_key}:p{page}:{chunk_type}:{content_hash}"
+
+def build_page_chunks(filename, page_num, text, tables):
+    """Split one page's text and tables into chunk records.
+
+    Each record carries its deterministic vector ID, the chunk text and its
+    metadata: source file, page, type ("text" or "table") and a chunk_id
+    unique within the corpus. Table records also keep the cleaned headers
+    and rows under "table", for the policy table store.
+    """
+    chunks = []
+
+    def add_chunk(chunk_text, chunk_type, position, **extra):
+        chunks.append({
+            "id": make_vector_id(filename, page_num, chunk_type, chunk_text),
+            "text": chunk_text,
+            "metadata": {
+                "source": filename,
+                "page": page_num,
+                "type": chunk_type,
+                "chunk_id": f"{filename}:{page_num}:{chunk_type}:{position}"
+            },
+            **extra
+        })
+
+    if text:
+        for position, chunk_text in enumerate(text_splitter.split_text(text)):
+            add_chunk(chunk_text, "text", position)
+    table_position = 0
+    for table in tables:
+        if table and len(table) > 1:  # Ensure table has headers and data
+            headers, columns = clean_table(table)
+            add_chunk(build_table_chunk(table), "table", table_position,
+                      table={"headers": headers, "rows": [list(row) for row in zip(*columns)]})
+            table_position += 1
+    return chunks
+
+def extract_pdf_chunks(pdf_path, previous_pages=None):
+    """Extract and chunk one PDF in a single pdfplumber pass.
+
+    Returns (pages, changed_pages). pages maps each page number (as a string)
+    to {"hash", "chunks"}; pages whose content hash matches previous_pages keep
+    their earlier chunk records, and changed_pages lists the keys rebuilt.
+    """
+    filename = os.path.basename(pdf_path)
+    previous_pages = previous_pages or {}
+    pages = {}
+    changed_pages = []
+    for page_num, text, tables in extract_pdf_pages(pdf_path):
+        page_key = str(page_num)
+        page_hash = page_content_hash(text, tables)
+        previous_page = previous_pages.get(page_key)
+        if previous_page and previous_page.get("hash") == page_hash:
+            pages[page_key] = previous_page
+            continue
+        pages[page_key] = {"hash": page_hash, "chunks": build_page_chunks(filename, page_num, text, tables)}
+        changed_pages.append(page_key)
+    return pages, changed_pages
+
+def extract_pdf_chunks_timed(pdf_path, previous_pages=None):
+    """Worker entry point: extract_pdf_chunks() plus the elapsed seconds."""
+    started = time.perf_counter()
+    pages, changed_pages = extract_pdf_chunks(pdf_path, previous_pages)
+    return pages, changed_pages, time.perf_counter() - started
@@ -2,7 +2,6 @@ import asyncio
 import logging
 from hypercorn.config import Config
 from hypercorn.asyncio import serve
-from app import asgi_app, initialize_pinecone, build_bm25_index, setup_llm_chain
 import os
 
 # Configure logging
@@ -11,30 +10,33 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Check HR_docs folder
-hr_docs_path = "HR_docs/"
-if not os.path.exists(hr_docs_path):
-    logging.error(f"❌ HR_docs folder not found at: {os.path.abspath(hr_docs_path)}")
-    os.makedirs(hr_docs_path)
-    logging.info("✅ Created HR_docs folder")
-else:
-    pdf_files = [f for f in os.listdir(hr_docs_path) if f.endswith('.pdf')]
-    logging.info(f"📚 Found {len(pdf_files)} PDF files in HR_docs folder:")
-    for pdf in pdf_files:
-        logging.info(f"   - {pdf}")
-
 async def main():
     # Set up logging
     logging.basicConfig(level=logging.INFO,
                        format='%(asctime)s - %(levelname)s - %(message)s')
     
+    # app is imported here, not at module level: spawned PDF extraction workers
+    # re-import this script and must not load the whole app
+    from app import asgi_app, initialize_vector_store, build_bm25_index, setup_llm_chain
+
+    # Check HR_docs folder
+    hr_docs_path = "HR_docs/"
+    if not os.path.exists(hr_docs_path):
+        logging.error(f"❌ HR_docs folder not found at: {os.path.abspath(hr_docs_path)}")
+        os.makedirs(hr_docs_path)
+        logging.info("✅ Created HR_docs folder")
+    else:
+        pdf_files = [f for f in os.listdir(hr_docs_path) if f.endswith('.pdf')]
+        logging.info(f"📚 Found {len(pdf_files)} PDF files in HR_docs folder:")
+        for pdf in pdf_files:
+            logging.info(f"   - {pdf}")
+    
     try:
-        # Initialize Pinecone
-        logging.info("🔧 Initializing Pinecone...")
-        initialize_pinecone()
+        # Initialize the vector backend (Pinecone, or local with VECTOR_BACKEND=local)
+        initialize_vector_store()
         
         # Build BM25 index
-        logging.info("🔍 Building BM25 index...")
+        logging.info("🔍 Loading BM25 index (rebuilt only if HR_docs changed)...")
         build_bm25_index(hr_docs_path)
         
         # Set up LLM and QA chain